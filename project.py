@@ -1,12 +1,25 @@
 import re
-from pyfiglet import Figlet
-from tabulate import tabulate
+import sys
+import json
 import os
 import uuid
+import bisect
+import heapq
+import itertools
+import time
+import mmap
 import pickle
+import sqlite3
+import struct
+import threading
+from array import array
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager, suppress
 from datetime import datetime
 
-figlet = Figlet()
+# pyfiglet, tabulate, numpy, asyncio and multiprocessing are imported where
+# they are used, so tests and headless deployments skip their import cost.
 
 # Files for owner credentials and inventory.
 # Credentials file holds owner id and password.
@@ -14,8 +27,359 @@ figlet = Figlet()
 CREDENTIALS_FILE = "owner_credentials.pkl"
 INVENTORY_FILE = "inventory.pkl"
 
-inventory = {}  # global inventory dict
-# Keys: item code (int). Values: dict with Name, Price, Quantity.
+# Journal file holds small change records appended after the last snapshot.
+# In journal mode a sale appends one record instead of re-pickling the
+# whole inventory. load_inventory() replays the journal over the snapshot.
+JOURNAL_FILE = "inventory.journal"
+JOURNAL_MODE = True
+journal_generation = 0  # generation of the snapshot the journal belongs to
+
+# Once the journal grows past either limit a background thread folds it
+# into a fresh snapshot, so startup replay stays bounded.
+JOURNAL_MAX_RECORDS = 1000
+JOURNAL_MAX_BYTES = 1024 * 1024
+journal_records = 0  # records appended since the last snapshot
+journal_lock = threading.RLock()  # guards the snapshot and journal files
+compactor_thread = None
+
+# Group commit: changes arriving within this many seconds share one fsync.
+# 0 makes every sale durable before confirm_purchase() returns.
+GROUP_COMMIT_WINDOW = 0.0
+sync_timer = None  # pending group commit, if any
+
+# Storage backend picked at startup with the VENDING_STORAGE env variable.
+# 'pickle' keeps the snapshot + journal files above.
+# 'binary' is the same with a fixed-width binary snapshot in BINARY_FILE.
+# 'mmap' memory-maps BINARY_FILE and updates quantities and prices in place.
+# 'sqlite' keeps one row per item in SQLITE_FILE and updates rows in place.
+STORAGE_BACKEND = os.environ.get("VENDING_STORAGE", "pickle")
+SQLITE_FILE = "inventory.db"
+BINARY_FILE = "inventory.bin"
+
+# Binary snapshot layout (little endian), version 1:
+#   header:  magic, version, flags, journal generation, record count,
+#            live record count, string table size
+#   records: one per item sorted by code - code, price in cents, quantity,
+#            name offset and length in the string table, record flags
+#   string table: utf-8 item names back to back
+BINARY_MAGIC = b"VMIV"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sHHIIII')
+BINARY_RECORD = struct.Struct('<QqIIHH')
+RECORD_DELETED = 1  # record flag: item removed, record kept as a tombstone
+
+# Number of locks ConcurrentInventory spreads item codes over.
+LOCK_STRIPES = 64
+
+# Optimistic checkouts: commits are serialized by commit_lock, which is only
+# held to compare item versions and apply the cart. A checkout whose items
+# changed since it validated retries up to OCC_MAX_RETRIES times.
+OCC_MAX_RETRIES = 10
+commit_lock = threading.Lock()
+
+# Seconds that units added to a cart stay reserved for it.
+RESERVATION_TTL = 15 * 60
+
+# Address of the HTTP/JSON service started by `python project.py serve`.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+MAX_REQUEST_BODY = 64 * 1024
+
+# Worker processes in fleet mode; each owns the item codes that hash to it.
+# The router sends at most FLEET_BATCH_LIMIT queued requests per round trip.
+FLEET_SHARDS = 4
+FLEET_BATCH_LIMIT = 256
+
+# Rendered pyfiglet banners keyed by (font, text). Banners are constant, so
+# each is rendered once and reused; with BANNER_CACHE_FILE set the cache is
+# also kept on disk so later runs skip loading fonts at all. Off by default,
+# set VENDING_BANNER_CACHE to a file name to turn it on.
+BANNER_CACHE_FILE = os.environ.get("VENDING_BANNER_CACHE") or None
+banner_cache = None  # loaded from BANNER_CACHE_FILE on first use
+
+# Sales ledger: every confirmed purchase is appended to numbered segment
+# files in LEDGER_DIR. Records are buffered and written LEDGER_BUFFER_BYTES
+# at a time; a new segment is started once one passes LEDGER_SEGMENT_BYTES.
+#   segment header: magic, version
+#   record: transaction id, unix time, line count, then per line
+#           item code, quantity, unit price in cents
+LEDGER_DIR = "sales"
+LEDGER_SEGMENT_BYTES = 4 * 1024 * 1024
+LEDGER_BUFFER_BYTES = 64 * 1024
+LEDGER_FLUSH_SECONDS = 5.0  # longest a buffered sale waits to be written
+LEDGER_MAGIC = b"VMSL"
+LEDGER_VERSION = 1
+LEDGER_HEADER = struct.Struct('<4sH')
+LEDGER_RECORD = struct.Struct('<8sdH')
+LEDGER_LINE = struct.Struct('<QIq')
+
+# Callables run after every confirmed purchase as
+# listener(transaction_id, timestamp, lines), lines being
+# (item code, quantity, unit price) tuples. main() adds the sales ledger.
+sale_listeners = []
+sales_ledger = None
+
+# Units and revenue per item per hour and per day, updated at each sale and
+# saved to ROLLUP_FILE along with how far into the ledger they reach.
+ROLLUP_FILE = "sales_rollups.pkl"
+sales_rollups = None
+# Saving prunes hourly buckets past FORECAST_HISTORY_HOURS, the most the
+# restock forecast reads, and daily buckets past ROLLUP_RETENTION_DAYS.
+# Overall totals are kept for good.
+ROLLUP_RETENTION_DAYS = 2 * 365
+
+# Callables run after an item's stock changes as listener(item_code, quantity);
+# quantity is None when the item is removed. main() adds the low stock queue,
+# which alerts once an item falls to LOW_STOCK_THRESHOLD units (or days of
+# cover) or below. Only the newest LOW_STOCK_ALERT_LIMIT alerts are kept
+# for the owner, so a long running service does not pile them up.
+stock_listeners = []
+LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_ALERT_LIMIT = 100
+low_stock = None
+low_stock_alerts = deque(maxlen=LOW_STOCK_ALERT_LIMIT)  # (item code, quantity) not yet shown
+
+# Checkouts under different ConcurrentInventory stripes, the service's
+# worker threads and the fleet dispatcher all call the listeners above;
+# they share one lock so the queues and trackers see one change at a time.
+listener_lock = threading.RLock()
+
+# Restock forecasting: hourly demand per item is an exponentially weighted
+# moving average with this half-life. Items projected to sell out within
+# RESTOCK_HORIZON_DAYS are topped up to RESTOCK_COVER_DAYS of demand.
+# Hourly sales older than FORECAST_HISTORY_HOURS are ignored.
+FORECAST_HALF_LIFE_HOURS = 7 * 24
+RESTOCK_HORIZON_DAYS = 3
+RESTOCK_COVER_DAYS = 14
+FORECAST_HISTORY_HOURS = 365 * 24
+
+# Items the best seller tracker keeps counters for, whatever the catalog size.
+# The tracker is saved to BEST_SELLERS_FILE with the ledger position it covers.
+HEAVY_HITTER_CAPACITY = 100
+BEST_SELLERS_FILE = "best_sellers.pkl"
+best_sellers = None
+
+# Rows per page in the owner's inventory view, and the keys it can sort by.
+PAGE_SIZE = 20
+SORT_KEYS = ('code', 'name', 'price', 'quantity')
+
+# In-memory layout for the pickle and binary backends.
+# 'items' keeps a dict of Item records. 'columnar' keeps codes, prices and
+# quantities in NumPy arrays so totals and bulk price changes are vectorized.
+INVENTORY_LAYOUT = os.environ.get("VENDING_LAYOUT", "items")
+
+
+# ---------- Item records ----------
+
+# base for slotted records that also read like the old item dicts.
+# KEYS maps dict keys ('Name', ...) to attribute names.
+# WRITABLE lists the keys that record['key'] = value may set.
+class Record:
+    __slots__ = ()
+    KEYS = {}
+    WRITABLE = ()
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, self.KEYS[key])
+
+    def __setitem__(self, key, value):
+        if key not in self.WRITABLE:
+            raise KeyError(key)
+        setattr(self, self.KEYS[key], value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.KEYS else default
+
+    def keys(self):
+        return self.KEYS.keys()
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, Mapping)):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+# one inventory item.
+# Slots keep it far smaller than a three-key dict per item.
+# version goes up on every item['Price'] / item['Quantity'] write, which
+# lets optimistic checkouts notice that an item changed under them.
+class Item(Record):
+    __slots__ = ('name', 'price', 'quantity', 'version')
+    KEYS = {'Name': 'name', 'Price': 'price', 'Quantity': 'quantity'}
+    WRITABLE = ('Price', 'Quantity')
+
+    def __init__(self, name, price, quantity):
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    # build an Item from anything with Name, Price, Quantity keys.
+    @classmethod
+    def from_mapping(cls, item):
+        return cls(item['Name'], item['Price'], item['Quantity'])
+
+
+# one line of a user cart.
+# Points at the inventory Item instead of copying its name and price,
+# so a cart line only adds the quantity.
+class CartLine(Record):
+    __slots__ = ('item', 'quantity')
+    KEYS = {'Name': 'name', 'Price': 'price', 'Quantity': 'quantity'}
+    WRITABLE = ('Quantity',)
+
+    def __init__(self, item, quantity):
+        # Rows of the SQLite or mmap stores go away on sell out: keep a copy.
+        if not isinstance(item, Item):
+            item = Item.from_mapping(item)
+        self.item = item
+        self.quantity = quantity
+
+    @property
+    def name(self):
+        return self.item.name
+
+    @property
+    def price(self):
+        return self.item.price
+
+
+# inventory dict with a case-insensitive name index.
+# Every way of adding or removing an item keeps the index in step, so
+# duplicate-name checks and name lookups are O(1) instead of a full scan.
+# code_order and name_order are sorted indexes for query(). They are built
+# on the first query and then kept up to date with bisect on every change.
+# Adding and removing items and querying take index_lock, so threads that
+# hold different ConcurrentInventory stripes can still sell items out.
+class Inventory(dict):
+    def __init__(self, items=()):
+        super().__init__()
+        self.name_index = {}  # casefolded name -> item code
+        self.code_order = None  # sorted item codes
+        self.name_order = None  # sorted (casefolded name, code) pairs
+        self.index_lock = threading.RLock()
+        self.update(items)
+
+    def __setitem__(self, code, item):
+        with self.index_lock:
+            if code in self:
+                self.unindex(code, self[code])
+            super().__setitem__(code, item)
+            key = item['Name'].casefold()
+            self.name_index[key] = code
+            if self.code_order is not None:
+                bisect.insort(self.code_order, code)
+                bisect.insort(self.name_order, (key, code))
+
+    def __delitem__(self, code):
+        with self.index_lock:
+            self.unindex(code, self[code])
+            super().__delitem__(code)
+
+    def unindex(self, code, item):
+        key = item['Name'].casefold()
+        if self.name_index.get(key) == code:
+            del self.name_index[key]
+        if self.code_order is not None:
+            del self.code_order[bisect.bisect_left(self.code_order, code)]
+            del self.name_order[bisect.bisect_left(self.name_order, (key, code))]
+
+    def pop(self, code, *default):
+        with self.index_lock:
+            if code in self:
+                self.unindex(code, self[code])
+            return super().pop(code, *default)
+
+    def popitem(self):
+        with self.index_lock:
+            code, item = super().popitem()
+            self.unindex(code, item)
+            return code, item
+
+    def setdefault(self, code, item=None):
+        if code not in self:
+            self[code] = item
+        return self[code]
+
+    # bulk loads drop the sorted indexes; the next query() re-sorts once.
+    def update(self, items=(), **kwargs):
+        with self.index_lock:
+            self.code_order = self.name_order = None
+            pairs = ((code, items[code]) for code in items.keys()) if hasattr(items, 'keys') else items
+            for code, item in pairs:
+                self[code] = item
+            for code, item in kwargs.items():
+                self[code] = item
+
+    def clear(self):
+        with self.index_lock:
+            super().clear()
+            self.name_index.clear()
+            self.code_order = self.name_order = None
+
+    # pickle and copy through __init__ so the index gets rebuilt.
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    # code of the item with this name, ignoring case.
+    # Returns None if no item has the name.
+    def code_for_name(self, name):
+        return self.name_index.get(name.casefold())
+
+    # codes of one page of matching items, and the number of matches.
+    # Inputs: inclusive code bounds, name prefix, sort key, page offset/limit.
+    # Filtering by code range sorted by code, or by name prefix sorted by
+    # name, reads only the page from the index.
+    def query(self, low=None, high=None, prefix=None, sort_by='code', descending=False, offset=0, limit=None):
+        with self.index_lock:
+            if self.code_order is None:
+                self.code_order = sorted(self)
+                self.name_order = sorted((item['Name'].casefold(), code) for code, item in self.items())
+
+            if prefix or sort_by == 'name':
+                index, order = self.name_order, 'name'
+                start, stop = 0, len(index)
+                if prefix:
+                    key = prefix.casefold()
+                    start = bisect.bisect_left(index, (key,))
+                    stop = bisect.bisect_left(index, (key[:-1] + chr(ord(key[-1]) + 1),))
+                positions = (index[position][1] for position in range(start, stop))
+            else:
+                index, order = self.code_order, 'code'
+                start = 0 if low is None else bisect.bisect_left(index, low)
+                stop = len(index) if high is None else bisect.bisect_right(index, high)
+                low = high = None  # applied by the bisect above
+                positions = (index[position] for position in range(start, stop))
+
+            if order == sort_by and low is None and high is None:
+                positions = range(start, stop)[::-1] if descending else range(start, stop)
+                page = positions[offset:] if limit is None else positions[offset:offset + limit]
+                if order == 'name':
+                    return [index[position][1] for position in page], len(positions)
+                return [index[position] for position in page], len(positions)
+
+            codes = [code for code in positions
+                     if (low is None or code >= low) and (high is None or code <= high)]
+            return order_codes(self, codes, sort_by, descending, offset, limit), len(codes)
+
+
+inventory = Inventory()  # global inventory dict
+# Keys: item code (int). Values: Item records with Name, Price, Quantity.
 
 
 # ---------- Helper functions (argument based) ----------
@@ -38,25 +402,29 @@ def input_positive_integer_arg(val):
 
 # add item to cart using passed structures.
 # Inputs: user_cart dict, inventory_ref dict, item_code, quantity.
-# Updates user_cart. Does not use IO.
+# Optional reservations (ReservationBook) and holder (defaults to the cart):
+# units reserved by other carts are not available, and the units in this
+# cart get reserved for it.
+# Updates user_cart with a CartLine. Does not use IO.
 # Raises KeyError if item missing. Raises ValueError for bad qty or low stock.
-def add_to_cart_arg(user_cart, inventory_ref, item_code, quantity):
+def add_to_cart_arg(user_cart, inventory_ref, item_code, quantity, reservations=None, holder=None):
     if item_code not in inventory_ref:
         raise KeyError("Item code not found in inventory")
     if quantity <= 0:
         raise ValueError("Quantity must be positive")
     available_quantity = inventory_ref[item_code]['Quantity']
+    if reservations is not None:
+        holder = id(user_cart) if holder is None else holder
+        available_quantity -= reservations.reserved_by_others(holder, item_code)
     already_in_cart = user_cart.get(item_code, {}).get('Quantity', 0)
     if already_in_cart + quantity > available_quantity:
         raise ValueError("Not enough quantity available")
     if item_code in user_cart:
         user_cart[item_code]['Quantity'] += quantity
     else:
-        user_cart[item_code] = {
-            "Name": inventory_ref[item_code]['Name'],
-            "Price": inventory_ref[item_code]['Price'],
-            "Quantity": quantity
-        }
+        user_cart[item_code] = CartLine(inventory_ref[item_code], quantity)
+    if reservations is not None:
+        reservations.hold(holder, item_code, user_cart[item_code]['Quantity'])
 
 
 # set new quantity for inventory item.
@@ -69,6 +437,7 @@ def adjust_quantity_arg(inventory_ref, item_code, new_quantity):
     if new_quantity < 0:
         raise ValueError("Quantity cannot be negative")
     inventory_ref[item_code]['Quantity'] = new_quantity
+    record_stock(item_code, new_quantity)
 
 
 # set new price for inventory item.
@@ -83,57 +452,1379 @@ def adjust_item_price_arg(inventory_ref, item_code, new_price):
     inventory_ref[item_code]['Price'] = new_price
 
 
+# change every price by a percentage.
+# Inputs: inventory_ref, percent (e.g. 10 for +10%, -5 for -5%).
+# New prices are rounded to cents. Vectorized for columnar stores.
+# Raises ValueError if a price would drop to zero or below.
+def adjust_all_prices_arg(inventory_ref, percent):
+    factor = 1 + percent / 100
+    if factor <= 0:
+        raise ValueError("Prices must stay positive")
+    if hasattr(inventory_ref, 'scale_prices'):
+        inventory_ref.scale_prices(factor)
+        return
+    for item in inventory_ref.values():
+        item['Price'] = round(item['Price'] * factor, 2)
+
+
+# total value of the stock.
+# Input: inventory_ref.
+# Returns sum of price * quantity. Stores with total_value() compute it
+# themselves (a dot product for columnar, SUM() for SQLite).
+def inventory_value_arg(inventory_ref):
+    if hasattr(inventory_ref, 'total_value'):
+        return inventory_ref.total_value()
+    return sum(item['Price'] * item['Quantity'] for item in inventory_ref.values())
+
+
+# find an item code by name, ignoring case.
+# Inputs: inventory_ref, name.
+# Uses the store's name index when it has one, else scans the items.
+# Returns the code or None.
+def find_item_by_name_arg(inventory_ref, name):
+    if hasattr(inventory_ref, 'code_for_name'):
+        return inventory_ref.code_for_name(name)
+    key = name.casefold()
+    for code, item in inventory_ref.items():
+        if item['Name'].casefold() == key:
+            return code
+    return None
+
+
+# one page of inventory rows, filtered and sorted.
+# Inputs: inventory_ref, page (from 1), page_size, low/high inclusive code
+# bounds, name prefix (ignores case), sort_by (one of SORT_KEYS), descending.
+# Output: ([code, name, price, quantity] rows on the page, number of matches).
+# Raises ValueError for a bad page, page size, code range or sort key.
+def query_items_arg(inventory_ref, page=1, page_size=PAGE_SIZE, low=None, high=None,
+                    prefix=None, sort_by='code', descending=False):
+    if page < 1 or page_size < 1:
+        raise ValueError("Page and page size must be positive")
+    if sort_by not in SORT_KEYS:
+        raise ValueError(f"Cannot sort by {sort_by}")
+    if low is not None and high is not None and low > high:
+        raise ValueError("Lowest code is above highest code")
+    offset = (page - 1) * page_size
+    if hasattr(inventory_ref, 'query'):
+        codes, total = inventory_ref.query(low, high, prefix, sort_by, descending, offset, page_size)
+    else:
+        key = prefix.casefold() if prefix else None
+        codes = [code for code, item in inventory_ref.items()
+                 if (low is None or code >= low) and (high is None or code <= high)
+                 and (key is None or item['Name'].casefold().startswith(key))]
+        total = len(codes)
+        codes = order_codes(inventory_ref, codes, sort_by, descending, offset, page_size)
+    rows = []
+    for code in codes:
+        item = inventory_ref[code]
+        rows.append([code, item['Name'], item['Price'], item['Quantity']])
+    return rows, total
+
+
+# sort codes by an item field and cut out one page.
+# Ties are broken by code. Only offset + limit codes are ever fully ordered.
+def order_codes(inventory_ref, codes, sort_by, descending, offset, limit):
+    if sort_by == 'code':
+        sort_key = None
+    elif sort_by == 'name':
+        sort_key = lambda code: (inventory_ref[code]['Name'].casefold(), code)
+    else:
+        field = sort_by.capitalize()
+        sort_key = lambda code: (inventory_ref[code][field], code)
+    if limit is None:
+        return sorted(codes, key=sort_key, reverse=descending)[offset:]
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    return pick(offset + limit, codes, key=sort_key)[offset:]
+
+
 # manage a cart item: remove or adjust.
 # Inputs: user_cart, inventory_ref, item_code, action, new_quantity.
+# Optional reservations and holder work as in add_to_cart_arg.
 # Action 'remove' deletes item. Action 'adjust' sets new quantity.
 # Raises KeyError or ValueError on bad inputs or insufficient stock.
-def manage_cart_arg(user_cart, inventory_ref, item_code, action, new_quantity=None):
+def manage_cart_arg(user_cart, inventory_ref, item_code, action, new_quantity=None,
+                    reservations=None, holder=None):
     if item_code not in user_cart:
         raise KeyError("Item not found in user cart")
+    if reservations is not None:
+        holder = id(user_cart) if holder is None else holder
     if action == 'remove':
         del user_cart[item_code]
+        if reservations is not None:
+            reservations.release(holder, item_code)
     elif action == 'adjust':
         if new_quantity is None:
             raise ValueError("new_quantity must be provided for adjustment")
         if new_quantity <= 0:
             raise ValueError("Quantity must be positive")
         available_quantity = inventory_ref.get(item_code, {}).get('Quantity', 0)
+        if reservations is not None:
+            available_quantity -= reservations.reserved_by_others(holder, item_code)
         if new_quantity > available_quantity:
             raise ValueError("Not enough quantity available")
         user_cart[item_code]['Quantity'] = new_quantity
+        if reservations is not None:
+            reservations.hold(holder, item_code, new_quantity)
     else:
         raise ValueError("Invalid action. Use 'remove' or 'adjust'")
 
 
 # validate and apply purchase without IO.
 # Inputs: user_cart, inventory_ref.
-# Checks stock, reduces inventory, removes zero items, clears cart.
+# Optional reservations and holder work as in add_to_cart_arg; the cart's
+# own reservations are released once it is bought.
+# Checks stock, reduces inventory, removes items the cart sold out, clears cart.
+# Cost depends on the cart size only, not on the inventory size.
 # Returns a short transaction id. Raises on errors.
-def confirm_purchase_arg(user_cart, inventory_ref):
+def confirm_purchase_arg(user_cart, inventory_ref, reservations=None, holder=None):
+    if reservations is not None and holder is None:
+        holder = id(user_cart)
+    validate_cart_arg(user_cart, inventory_ref, reservations, holder)
+    return commit_cart_arg(user_cart, inventory_ref, reservations, holder)
+
+
+# check a cart against stock without changing anything.
+# Inputs: user_cart, inventory_ref, optional reservations and holder.
+# Raises ValueError for an empty cart or low stock, KeyError for missing items.
+def validate_cart_arg(user_cart, inventory_ref, reservations=None, holder=None):
     if not user_cart:
         raise ValueError("Cart is empty")
     for code, item in user_cart.items():
         if code not in inventory_ref:
             raise KeyError(f"Item code {code} not found in inventory")
-        if item['Quantity'] > inventory_ref[code]['Quantity']:
+        available_quantity = inventory_ref[code]['Quantity']
+        if reservations is not None:
+            available_quantity -= reservations.reserved_by_others(holder, code)
+        if item['Quantity'] > available_quantity:
             raise ValueError(f"Not enough item {item['Name']} in inventory")
 
+
+# apply an already validated cart.
+# Inputs: user_cart, inventory_ref, optional reservations and holder.
+# Reduces stock, removes items the cart sold out, clears cart.
+# Returns a short transaction id.
+def commit_cart_arg(user_cart, inventory_ref, reservations=None, holder=None):
+    # Only the cart's items can sell out, so only they are checked.
     for code, item in user_cart.items():
         inventory_ref[code]['Quantity'] -= item['Quantity']
-
-    to_remove = [code for code, item in inventory_ref.items() if item['Quantity'] == 0]
-    for code in to_remove:
-        del inventory_ref[code]
+        quantity = inventory_ref[code]['Quantity']
+        if quantity == 0:
+            del inventory_ref[code]
+        if stock_listeners:
+            record_stock(code, quantity)
+            if quantity == 0:
+                record_stock(code, None)
+    if reservations is not None:
+        reservations.release(holder)
 
     transaction_id = str(uuid.uuid4())[:8]
+    if sale_listeners:
+        record_sale(transaction_id, sale_lines(user_cart))
     user_cart.clear()
     return transaction_id
 
 
+# (item code, quantity, unit price) for each line of a cart.
+def sale_lines(user_cart):
+    return tuple((code, item['Quantity'], item['Price']) for code, item in user_cart.items())
+
+
+# pass an item's new stock level to every stock listener.
+# Inputs: item code, quantity (None when the item is removed).
+# An item sold out at checkout reports 0, then None as it leaves the inventory.
+# Listeners run under listener_lock, one call at a time.
+def record_stock(item_code, quantity):
+    with listener_lock:
+        for listener in stock_listeners:
+            listener(item_code, quantity)
+
+
+# pass a confirmed purchase to every sale listener.
+# Inputs: transaction id, lines from sale_lines().
+# Listeners run under listener_lock, one call at a time.
+def record_sale(transaction_id, lines):
+    timestamp = time.time()
+    with listener_lock:
+        for listener in sale_listeners:
+            listener(transaction_id, timestamp, lines)
+
+
+# validate and apply purchase with optimistic concurrency.
+# Inputs: user_cart, inventory_ref, max_retries.
+# Reads item versions and validates the cart without holding any lock.
+# The commit then only re-checks the versions and applies the cart under
+# commit_lock, a few dict operations long. If another checkout changed
+# one of the cart's items in between, just this cart is validated again.
+# The item objects are compared too: an item sold out and re-added under
+# the same code is a new Item whose version starts again at 0.
+# Items without a version (plain dicts, SQL rows) are committed under the
+# lock in one go. Returns a short transaction id.
+# Raises like confirm_purchase_arg, or RuntimeError after max_retries conflicts.
+def confirm_purchase_optimistic_arg(user_cart, inventory_ref, max_retries=OCC_MAX_RETRIES):
+    for _ in range(max_retries):
+        items = {code: inventory_ref.get(code) for code in user_cart}
+        versions = {code: getattr(item, 'version', None) for code, item in items.items()}
+        if None in versions.values():
+            with commit_lock:
+                return confirm_purchase_arg(user_cart, inventory_ref)
+        validate_cart_arg(user_cart, inventory_ref)
+        with commit_lock:
+            if all(inventory_ref.get(code) is items[code] and items[code].version == version
+                   for code, version in versions.items()):
+                return commit_cart_arg(user_cart, inventory_ref)
+    raise RuntimeError("Checkout kept conflicting with other purchases. Please try again.")
+
+
+# validate and apply many purchases in one pass without IO.
+# Inputs: list of user_carts, inventory_ref.
+# Carts are checked in order against the stock left by earlier accepted
+# carts. Accepted carts are cleared; rejected carts are left as they were.
+# Stock is written once per touched item code at the end.
+# Returns a list with ('accepted', transaction_id) or ('rejected', reason)
+# for each cart.
+def confirm_purchases_batch_arg(user_carts, inventory_ref):
+    remaining = {}  # item code -> stock left after accepted carts
+    results = []
+    for user_cart in user_carts:
+        reason = None
+        if not user_cart:
+            reason = "Cart is empty"
+        for code, item in user_cart.items():
+            if code not in remaining:
+                if code not in inventory_ref:
+                    reason = f"Item code {code} not found in inventory"
+                    break
+                remaining[code] = inventory_ref[code]['Quantity']
+            if item['Quantity'] > remaining[code]:
+                reason = f"Not enough item {item['Name']} in inventory"
+                break
+        if reason is not None:
+            results.append(('rejected', reason))
+            continue
+        for code, item in user_cart.items():
+            remaining[code] -= item['Quantity']
+        transaction_id = str(uuid.uuid4())[:8]
+        results.append(('accepted', transaction_id))
+        if sale_listeners:
+            record_sale(transaction_id, sale_lines(user_cart))
+
+    for code, quantity in remaining.items():
+        if quantity == inventory_ref[code]['Quantity']:
+            continue
+        if quantity == 0:
+            del inventory_ref[code]
+        else:
+            inventory_ref[code]['Quantity'] = quantity
+        if stock_listeners:
+            record_stock(code, quantity)
+            if quantity == 0:
+                record_stock(code, None)
+    for user_cart, (status, _) in zip(user_carts, results):
+        if status == 'accepted':
+            user_cart.clear()
+    return results
+
+
+# ---------- Concurrent inventory ----------
+
+# thread-safe wrapper around an in-memory inventory.
+# Item codes are spread over striped locks, so sessions touching different
+# items check out in parallel while two checkouts of the same item wait
+# for each other. Multi-item operations take their stripes in index order,
+# which rules out deadlocks. Wraps dict-like stores (Inventory, columnar).
+class ConcurrentInventory(MutableMapping):
+    def __init__(self, inventory_ref, stripes=LOCK_STRIPES):
+        self.data = inventory_ref
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    # hold the stripe locks for all given item codes.
+    @contextmanager
+    def locked(self, codes):
+        stripes = sorted({hash(code) % len(self.locks) for code in codes})
+        for stripe in stripes:
+            self.locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.locks[stripe].release()
+
+    def __getitem__(self, code):
+        return self.data[code]
+
+    def __setitem__(self, code, item):
+        with self.locked([code]):
+            self.data[code] = item
+
+    def __delitem__(self, code):
+        with self.locked([code]):
+            del self.data[code]
+
+    def __contains__(self, code):
+        return code in self.data
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    # The _arg helpers, run under the locks of the codes they touch.
+
+    def add_to_cart(self, user_cart, item_code, quantity):
+        with self.locked([item_code]):
+            add_to_cart_arg(user_cart, self.data, item_code, quantity)
+
+    def manage_cart(self, user_cart, item_code, action, new_quantity=None):
+        with self.locked([item_code]):
+            manage_cart_arg(user_cart, self.data, item_code, action, new_quantity)
+
+    def checkout(self, user_cart):
+        with self.locked(list(user_cart)):
+            return confirm_purchase_arg(user_cart, self.data)
+
+    def adjust_quantity(self, item_code, new_quantity):
+        with self.locked([item_code]):
+            adjust_quantity_arg(self.data, item_code, new_quantity)
+
+    def adjust_price(self, item_code, new_price):
+        with self.locked([item_code]):
+            adjust_item_price_arg(self.data, item_code, new_price)
+
+
+# ---------- Stock reservations ----------
+
+# units held by carts for a limited time.
+# Adding to a cart reserves the units for RESERVATION_TTL seconds (renewed
+# on every change), so two carts cannot both count on the last unit.
+# reserved keeps a running total per item code, which makes the
+# "reserved by other carts" check O(1). Expired holds are reclaimed from a
+# min-heap of expiry times as a side effect of each call.
+class ReservationBook:
+    def __init__(self, ttl=RESERVATION_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.reserved = {}  # item code -> units held by all carts
+        self.holds = {}  # holder -> {item code: (units, expires_at)}
+        self.expiry_heap = []  # (expires_at, tie breaker, holder, item code)
+        self.counter = itertools.count()
+
+    # release every hold whose time is up.
+    # Heap entries for holds that were renewed or released are skipped.
+    def expire(self):
+        now = self.clock()
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires_at, _, holder, code = heapq.heappop(self.expiry_heap)
+            hold = self.holds.get(holder, {}).get(code)
+            if hold is not None and hold[1] == expires_at:
+                self.release(holder, code)
+
+    # units of an item held by one holder.
+    def held(self, holder, code):
+        return self.holds.get(holder, {}).get(code, (0, None))[0]
+
+    # units of an item held by every holder except this one.
+    def reserved_by_others(self, holder, code):
+        self.expire()
+        return self.reserved.get(code, 0) - self.held(holder, code)
+
+    # stock of an item that no other cart holds.
+    def available(self, inventory_ref, code, holder=None):
+        return inventory_ref[code]['Quantity'] - self.reserved_by_others(holder, code)
+
+    # set how many units of an item a holder reserves, renewing the TTL.
+    def hold(self, holder, code, quantity):
+        self.expire()
+        self.release(holder, code)
+        if quantity <= 0:
+            return
+        expires_at = self.clock() + self.ttl
+        self.holds.setdefault(holder, {})[code] = (quantity, expires_at)
+        self.reserved[code] = self.reserved.get(code, 0) + quantity
+        if expires_at != float('inf'):  # holds that never expire skip the heap
+            heapq.heappush(self.expiry_heap, (expires_at, next(self.counter), holder, code))
+
+    # drop one hold, or every hold of the holder when code is None.
+    def release(self, holder, code=None):
+        codes = list(self.holds.get(holder, {})) if code is None else [code]
+        for item_code in codes:
+            hold = self.holds.get(holder, {}).pop(item_code, None)
+            if hold is None:
+                continue
+            self.reserved[item_code] -= hold[0]
+            if not self.reserved[item_code]:
+                del self.reserved[item_code]
+        if holder in self.holds and not self.holds[holder]:
+            del self.holds[holder]
+
+
+# ---------- Low stock alerts ----------
+
+# indexed min-heap of items by stock level.
+# The key is the quantity, or with a daily_rate(item code) function the days
+# of cover left (quantity / units sold per day). position maps each item code
+# to its heap slot, so update() re-sifts just that entry in O(log n).
+# Alert listeners are called as listener(item code, quantity) when an item
+# drops to the threshold or below, or runs out; nothing is ever scanned.
+class LowStockQueue:
+    def __init__(self, threshold=LOW_STOCK_THRESHOLD, daily_rate=None):
+        self.threshold = threshold
+        self.daily_rate = daily_rate
+        self.heap = []  # (key, item code)
+        self.position = {}  # item code -> index in heap
+        self.quantities = {}  # item code -> quantity
+        self.alert_listeners = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    # key of an item with this quantity.
+    def key(self, code, quantity):
+        if self.daily_rate is None:
+            return quantity
+        rate = self.daily_rate(code)
+        return quantity / rate if rate > 0 else float('inf')
+
+    # index every item of an inventory at once (heapify, O(n)).
+    def load(self, inventory_ref):
+        self.quantities = {code: item['Quantity'] for code, item in inventory_ref.items()}
+        self.heap = [(self.key(code, quantity), code) for code, quantity in self.quantities.items()]
+        heapq.heapify(self.heap)
+        self.position = {code: index for index, (_, code) in enumerate(self.heap)}
+
+    # new stock level of one item; a stock listener.
+    # None drops the item. Items at 0 stay indexed until they are removed.
+    def update(self, code, quantity):
+        if quantity is None:
+            self.discard(code)
+            return
+        entry = (self.key(code, quantity), code)
+        index = self.position.get(code)
+        old_quantity = self.quantities.get(code)
+        self.quantities[code] = quantity
+        if index is None:
+            old_key = None
+            self.heap.append(entry)
+            self.sift_up(len(self.heap) - 1)
+        else:
+            old_key = self.heap[index][0]
+            self.heap[index] = entry
+            self.sift_up(index)
+            self.sift_down(self.position[code])
+        if entry[0] <= self.threshold and (old_key is None or old_key > self.threshold):
+            self.alert(code, quantity)
+        elif quantity == 0 and old_quantity != 0:
+            self.alert(code, 0)
+
+    def discard(self, code):
+        index = self.position.pop(code, None)
+        if index is None:
+            return
+        del self.quantities[code]
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self.heap[index] = last
+            self.position[last[1]] = index
+            self.sift_up(index)
+            self.sift_down(self.position[last[1]])
+
+    def alert(self, code, quantity):
+        for listener in self.alert_listeners:
+            listener(code, quantity)
+
+    # up to k lowest items as (item code, quantity, key), lowest first.
+    # Input: only_low to stop at the threshold.
+    # Walks the heap from the root with a small frontier heap: O(k log k).
+    def lowest(self, k, only_low=False):
+        result = []
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier and len(result) < k:
+            (key, code), index = heapq.heappop(frontier)
+            if only_low and key > self.threshold:
+                break
+            result.append((code, self.quantities[code], key))
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return result
+
+    def sift_up(self, index):
+        heap, entry = self.heap, self.heap[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[index] = heap[parent]
+            self.position[heap[index][1]] = index
+            index = parent
+        heap[index] = entry
+        self.position[entry[1]] = index
+
+    def sift_down(self, index):
+        heap, entry = self.heap, self.heap[index]
+        while True:
+            child = 2 * index + 1
+            if child >= len(heap):
+                break
+            if child + 1 < len(heap) and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[index] = heap[child]
+            self.position[heap[index][1]] = index
+            index = child
+        heap[index] = entry
+        self.position[entry[1]] = index
+
+
+# start watching the global inventory for low stock.
+# Alerts are queued in low_stock_alerts for the owner menu.
+def open_low_stock():
+    global low_stock
+    if low_stock is None:
+        low_stock = LowStockQueue()
+        low_stock.alert_listeners.append(lambda code, quantity: low_stock_alerts.append((code, quantity)))
+        stock_listeners.append(low_stock.update)
+    low_stock.load(inventory)
+    return low_stock
+
+
+# ---------- Restock forecasting ----------
+
+# restock plan from current stock and sparse hourly sales, in NumPy.
+# Inputs: codes and quantities of the stock; sale_codes, sale_hours and
+# sale_units, sequences with an entry per item per hour it sold in (repeats
+# add up); now_hour (hours since the epoch); half_life in hours;
+# horizon_days; cover_days. Sales older than FORECAST_HISTORY_HOURS are
+# left out.
+# The EWMA after the last hour equals the sum of alpha * (1 - alpha) ** age
+# * units over the sales, so one weighted np.bincount gives every item's
+# rate per hour in O(sales entries), without a dense items x hours array.
+# Returns [(item code, quantity, new quantity, hours until sold out)],
+# soonest first.
+def forecast_restock(codes, quantities, sale_codes, sale_hours, sale_units, now_hour,
+                     half_life=FORECAST_HALF_LIFE_HOURS, horizon_days=RESTOCK_HORIZON_DAYS,
+                     cover_days=RESTOCK_COVER_DAYS):
+    import numpy as np
+    codes = np.asarray(codes, dtype=np.int64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    # Copied, so a sale appended meanwhile cannot hit an exported buffer
+    sale_codes = np.array(sale_codes, dtype=np.int64)
+    sale_units = np.array(sale_units, dtype=np.float64)
+    ages = now_hour - np.array(sale_hours, dtype=np.int64)
+    if not len(codes):
+        return []
+    recent = (ages >= 0) & (ages < FORECAST_HISTORY_HOURS)
+
+    # Map each sale to the stock row of its item code: a direct lookup
+    # table when codes are compact, else a binary search over sorted codes
+    top = int(max(codes.max(), sale_codes.max(initial=0)))
+    if codes.min() >= 0 and top <= 8 * len(codes) + 1024:
+        lookup = np.full(top + 1, -1, dtype=np.int64)
+        lookup[codes] = np.arange(len(codes))
+        rows = lookup[np.maximum(sale_codes, 0)]
+        known = recent & (sale_codes >= 0) & (rows >= 0)
+        rows = rows[known]
+    else:
+        sold, sold_index = np.unique(sale_codes, return_inverse=True)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        slots = np.minimum(np.searchsorted(sorted_codes, sold), len(codes) - 1)
+        sold_rows = np.where(sorted_codes[slots] == sold, order[slots], -1)
+        rows = sold_rows[sold_index]
+        known = recent & (rows >= 0)
+        rows = rows[known]
+
+    alpha = 1 - 0.5 ** (1 / half_life)
+    weights = sale_units[known] * alpha * (1 - alpha) ** ages[known]
+    rates = np.bincount(rows, weights=weights, minlength=len(codes))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hours_left = np.where(rates > 0, quantities / rates, np.inf)
+    targets = np.ceil(rates * 24 * cover_days).astype(np.int64)
+    due = np.flatnonzero((hours_left < horizon_days * 24) & (targets > quantities))
+    due = due[np.argsort(hours_left[due], kind='stable')]
+    return list(zip(codes[due].tolist(), quantities[due].tolist(),
+                    targets[due].tolist(), hours_left[due].tolist()))
+
+
+# restock plan for an inventory from the hourly sales rollups.
+# Inputs: inventory_ref, rollups, optional now (unix time), forecast options.
+# The rollups keep their sale lines in arrays, so NumPy reads them in bulk.
+# Returns forecast_restock() rows.
+def restock_plan_arg(inventory_ref, rollups, now=None, **options):
+    now_hour = int((time.time() if now is None else now) // 3600)
+    codes = array('q', inventory_ref.keys())
+    quantities = array('q', [item['Quantity'] for item in inventory_ref.values()])
+    return forecast_restock(codes, quantities, rollups.sale_codes, rollups.sale_hours,
+                            rollups.sale_units, now_hour, **options)
+
+
+# set every item of a restock plan to its new quantity.
+# Inputs: inventory_ref, plan rows from restock_plan_arg().
+# Checks every item first, so a bad plan changes nothing.
+# Raises KeyError if an item is gone. Returns journal records for the changes.
+def apply_restock_plan_arg(inventory_ref, plan):
+    for code, _, _, _ in plan:
+        if code not in inventory_ref:
+            raise KeyError(f"Item code {code} not found in inventory")
+    records = []
+    for code, _, new_quantity, _ in plan:
+        adjust_quantity_arg(inventory_ref, code, new_quantity)
+        records.append(('quantity', code, new_quantity))
+    return records
+
+
+# ---------- HTTP/JSON service ----------
+# One asyncio process serves many customer sessions at once. Carts live on
+# the server, keyed by session id, and every request maps onto an _arg
+# helper. Handlers never await in the middle of a helper, so the event
+# loop runs them one at a time and needs no locks. Their journal records
+# are written by a worker thread before the replies go out, so fsyncs
+# never stall the loop.
+#
+#   GET    /items                          inventory
+#   POST   /sessions                       new session -> {"session": id}
+#   DELETE /sessions/<id>                  drop session and its holds
+#   GET    /sessions/<id>/cart             cart and total
+#   POST   /sessions/<id>/cart             {"code", "quantity"} add to cart
+#   POST   /sessions/<id>/cart/<code>      {"action", "quantity"} manage cart
+#   POST   /sessions/<id>/checkout         -> {"transaction_id": ...}
+#   POST   /owner/items/<code>/quantity    {"owner_id", "password", "quantity"}
+#   POST   /owner/items/<code>/price       {"owner_id", "password", "price"}
+
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 403: "Forbidden",
+                404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+# HTTP/JSON front end for the cart and inventory helpers.
+# Inputs: inventory_ref, owner credentials, persist (record changes with
+# persist_changes() like the CLI does).
+# Without owner credentials the owner routes are refused. A session left
+# unused for the reservation TTL is dropped with its holds; sessions are
+# kept in order of last use, so expired ones are always at the front.
+class VendingService:
+    def __init__(self, inventory_ref, owner_id=None, owner_password=None, persist=False):
+        self.inventory = inventory_ref
+        self.owner_id = owner_id
+        self.owner_password = owner_password
+        self.persist = persist
+        self.sessions = {}  # session id -> cart
+        self.reservations = ReservationBook()
+        self.session_expiry = OrderedDict()  # session id -> expires_at, soonest first
+        self.pending = []  # journal records of handled requests, not yet written
+        self.persist_lock = None  # asyncio.Lock, made on the event loop
+
+    # route one request.
+    # Inputs: method, path, parsed JSON body (dict).
+    # Returns (status code, JSON-ready payload).
+    def handle(self, method, path, body):
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        self.expire_sessions()
+        try:
+            if parts == ['items'] and method == 'GET':
+                return 200, [self.item_json(code, item) for code, item in self.inventory.items()]
+            if parts == ['sessions'] and method == 'POST':
+                session = uuid.uuid4().hex
+                self.sessions[session] = {}
+                self.touch_session(session)
+                return 201, {"session": session}
+            if len(parts) >= 2 and parts[0] == 'sessions':
+                return self.handle_session(method, parts[1], parts[2:], body)
+            if len(parts) == 4 and parts[0] == 'owner' and parts[1] == 'items' and method == 'POST':
+                return self.handle_owner(int(parts[2]), parts[3], body)
+            return 404, {"error": "Not found"}
+        except KeyError as e:
+            return 404, {"error": str(e.args[0]) if e.args else "Not found"}
+        except (TypeError, ValueError) as e:
+            return 400, {"error": str(e)}
+
+    # push a session's expiry back by the reservation TTL.
+    def touch_session(self, session):
+        self.session_expiry[session] = self.reservations.clock() + self.reservations.ttl
+        self.session_expiry.move_to_end(session)
+
+    # drop sessions unused for the reservation TTL, releasing their holds.
+    def expire_sessions(self):
+        now = self.reservations.clock()
+        while self.session_expiry:
+            session, expires_at = next(iter(self.session_expiry.items()))
+            if expires_at > now:
+                break
+            self.end_session(session)
+
+    def end_session(self, session):
+        self.reservations.release(session)
+        del self.sessions[session]
+        del self.session_expiry[session]
+
+    def handle_session(self, method, session, rest, body):
+        if session not in self.sessions:
+            raise KeyError("Session not found")
+        self.touch_session(session)
+        user_cart = self.sessions[session]
+        if not rest and method == 'DELETE':
+            self.end_session(session)
+            return 200, {}
+        if rest == ['cart'] and method == 'GET':
+            return 200, self.cart_json(user_cart)
+        if rest == ['cart'] and method == 'POST':
+            add_to_cart_arg(user_cart, self.inventory, int(body.get('code')),
+                            input_positive_integer_arg(body.get('quantity')), self.reservations, session)
+            return 200, self.cart_json(user_cart)
+        if len(rest) == 2 and rest[0] == 'cart' and method == 'POST':
+            quantity = body.get('quantity')
+            manage_cart_arg(user_cart, self.inventory, int(rest[1]), body.get('action'),
+                            None if quantity is None else int(quantity), self.reservations, session)
+            return 200, self.cart_json(user_cart)
+        if rest == ['checkout'] and method == 'POST':
+            record = purchase_record(user_cart)
+            total = self.cart_json(user_cart)["total"]
+            transaction_id = confirm_purchase_arg(user_cart, self.inventory, self.reservations, session)
+            if self.persist:
+                self.pending.append(record)
+            return 200, {"transaction_id": transaction_id, "total": total}
+        return 405, {"error": "Method not allowed"}
+
+    def handle_owner(self, code, field, body):
+        if self.owner_id is None or self.owner_password is None:
+            return 403, {"error": "Owner access is not configured"}
+        if body.get('owner_id') != self.owner_id or body.get('password') != self.owner_password:
+            return 403, {"error": "Incorrect ID or password"}
+        if field == 'quantity':
+            quantity = int(body.get('quantity'))
+            adjust_quantity_arg(self.inventory, code, quantity)
+            record = ('quantity', code, quantity)
+        elif field == 'price':
+            price = float(body.get('price'))
+            adjust_item_price_arg(self.inventory, code, price)
+            record = ('price', code, price)
+        else:
+            return 404, {"error": "Not found"}
+        if self.persist:
+            self.pending.append(record)
+        return 200, self.item_json(code, self.inventory[code])
+
+    # write the records of the requests handled so far.
+    # Runs persist_changes() in the default executor. Batches go out one
+    # at a time in order, and records queued meanwhile share the next one.
+    # SQLite commits on the loop, as its connection belongs to this thread.
+    async def persist_pending(self):
+        import asyncio
+        if self.persist_lock is None:
+            self.persist_lock = asyncio.Lock()
+        async with self.persist_lock:
+            if not self.pending:
+                return
+            records, self.pending = self.pending, []
+            if STORAGE_BACKEND == 'sqlite':
+                persist_changes(records)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, persist_changes, records)
+
+    @staticmethod
+    def item_json(code, item):
+        return {"code": code, "name": item['Name'], "price": item['Price'], "quantity": item['Quantity']}
+
+    def cart_json(self, user_cart):
+        items = [self.item_json(code, item) for code, item in user_cart.items()]
+        return {"items": items, "total": round(sum(i["price"] * i["quantity"] for i in items), 2)}
+
+    # serve HTTP/1.1 requests on one connection until the client closes it.
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_REQUEST_BODY:
+                    status, payload = 413, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    raw = await reader.readexactly(length) if length else b''
+                    try:
+                        body = json.loads(raw) if raw else {}
+                        if not isinstance(body, dict):
+                            raise ValueError("JSON body must be an object")
+                    except ValueError as e:
+                        status, payload = 400, {"error": f"Invalid JSON: {e}"}
+                    else:
+                        status, payload = self.handle(method.upper(), path, body)
+                        await self.persist_pending()
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, EOFError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # start listening. Returns the asyncio server.
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        import asyncio
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+# run the service on the global inventory until interrupted.
+# Loads credentials and inventory like main() does.
+def run_service(host=SERVICE_HOST, port=SERVICE_PORT):
+    import asyncio
+    owner_id, owner_password = setup_or_load_credentials()
+    load_inventory()
+    open_low_stock()
+    ledger = open_sales_ledger()
+    open_sales_rollups(ledger)
+    open_best_sellers(ledger)
+    service = VendingService(inventory, owner_id, owner_password, persist=True)
+
+    async def serve():
+        server = await service.start(host, port)
+        print(f"Serving the vending machine on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        save_inventory()
+        flush_sales()
+
+
+# ---------- Fleet mode (sharded worker processes) ----------
+# Item codes are split over worker processes by hash(code) % shards. A
+# router sends each part of a cart to the shard owning it and checks out
+# with two-phase commit: every shard first validates and holds its part
+# ('prepare'), and only when all agree are the parts applied ('commit');
+# otherwise the holds are dropped ('abort'). Prepare and commit are
+# validate_cart_arg() and commit_cart_arg() with a ReservationBook
+# keyed by transaction id, so shards follow confirm_purchase_arg rules.
+#
+# One router serves every thread. Callers queue their requests and a
+# dispatcher thread takes all that are waiting as one batch: each shard
+# gets one message with its prepares, then one with its commits, aborts
+# and other requests, so a round trip is shared by the whole batch and
+# the shards work on it in parallel.
+
+# shard that owns an item code.
+def shard_for(code, shards):
+    return hash(code) % shards
+
+
+# request loop of one shard worker process.
+# Inputs: pipe connection, dict of the shard's items.
+# Each message is a list of requests, answered with a list holding
+# ('ok', result) or ('error', (type name, message)) for each. None stops it.
+def shard_worker(connection, items):
+    sale_listeners.clear()  # the router records sales, with prices
+    stock_listeners.clear()
+    inventory_ref = Inventory((code, Item.from_mapping(item)) for code, item in items.items())
+    holds = ReservationBook(ttl=float('inf'))
+    while True:
+        requests = connection.recv()
+        if requests is None:
+            break
+        answers = []
+        for op, *args in requests:
+            try:
+                answers.append(('ok', shard_request(inventory_ref, holds, op, args)))
+            except (KeyError, ValueError) as e:
+                answers.append(('error', (type(e).__name__, e.args[0] if e.args else "")))
+        connection.send(answers)
+
+
+# carry out one request on a shard's items. Returns its result.
+def shard_request(inventory_ref, holds, op, args):
+    if op == 'prepare':
+        transaction_id, lines = args
+        cart = {code: {"Name": name, "Quantity": quantity} for code, name, quantity in lines}
+        validate_cart_arg(cart, inventory_ref, holds, transaction_id)
+        for code, item in cart.items():
+            holds.hold(transaction_id, code, item['Quantity'])
+        return None
+    if op == 'commit':
+        transaction_id, lines = args
+        cart = {code: {"Name": name, "Quantity": quantity} for code, name, quantity in lines}
+        commit_cart_arg(cart, inventory_ref, holds, transaction_id)
+        # new stock of each item, 0 once sold out and removed
+        return [(code, inventory_ref[code]['Quantity'] if code in inventory_ref else 0) for code, _, _ in lines]
+    if op == 'abort':
+        holds.release(args[0])
+        return None
+    if op == 'get':
+        item = inventory_ref.get(args[0])
+        return None if item is None else dict(item)
+    if op == 'items':
+        return {code: dict(item) for code, item in inventory_ref.items()}
+    if op == 'adjust_quantity':
+        adjust_quantity_arg(inventory_ref, *args)
+        return None
+    if op == 'adjust_price':
+        adjust_item_price_arg(inventory_ref, *args)
+        return None
+    raise ValueError(f"Unknown shard request {op!r}")
+
+
+# KeyError or ValueError for an error answered by a shard.
+def shard_error(payload):
+    name, message = payload
+    return (KeyError if name == 'KeyError' else ValueError)(message)
+
+
+# router for a fleet of shard worker processes, shared by all threads.
+# Inputs: inventory mapping to split, number of shards, persist (journal
+# the shards' changes with record_changes(), for the global inventory).
+# Offers the cart and owner helpers for the whole fleet. While it runs the
+# shards hold the stock; stock changes still reach the stock listeners.
+# close() (or leaving the router as a context manager) stops the workers
+# and writes their stock back to inventory_ref.
+# Raises ValueError for persist with the sqlite or mmap backend: their
+# stores belong to the thread that opened them, not to the dispatcher.
+class FleetRouter:
+    def __init__(self, inventory_ref, shards=FLEET_SHARDS, persist=False):
+        import multiprocessing
+        import queue
+        if persist and STORAGE_BACKEND in ('sqlite', 'mmap'):
+            raise ValueError(f"Fleet persistence needs a journal, not the {STORAGE_BACKEND} backend; "
+                             "save the records close() returns instead")
+        self.inventory = inventory_ref
+        self.persist = persist
+        parts = [{} for _ in range(shards)]
+        for code, item in inventory_ref.items():
+            parts[shard_for(code, shards)][code] = dict(item)
+        self.connections = []
+        self.workers = []
+        for part in parts:
+            router_end, worker_end = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_worker, args=(worker_end, part), daemon=True)
+            worker.start()
+            self.connections.append(router_end)
+            self.workers.append(worker)
+        self.requests = queue.Queue()  # (request, future), None to stop
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # queue one request for the dispatcher and wait for its result.
+    # Raises the request's error here.
+    def submit(self, request):
+        from concurrent.futures import Future
+        if self.dispatcher is None:
+            raise ValueError("Fleet router is closed")
+        future = Future()
+        self.requests.put((request, future))
+        return future.result()
+
+    # dispatcher thread: run the waiting requests in batches until stopped.
+    def dispatch(self):
+        import queue
+        while True:
+            batch = [self.requests.get()]
+            while batch[-1] is not None and len(batch) < FLEET_BATCH_LIMIT:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    self.run_batch(batch)
+                except BaseException as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stop:
+                return
+
+    # send each shard its list of requests, then collect the answers.
+    # Input: list with a request list per shard; shards with none are skipped.
+    # Returns a list with an answer list per shard.
+    def exchange(self, requests):
+        for connection, shard_requests in zip(self.connections, requests):
+            if shard_requests:
+                connection.send(shard_requests)
+        return [connection.recv() if shard_requests else []
+                for connection, shard_requests in zip(self.connections, requests)]
+
+    # run one batch of (request, future) in two rounds of messages.
+    # Prepares go first; commits, aborts and the other requests follow, in
+    # the order they were queued. The shards' changes are then persisted
+    # with one write before any caller returns. Without a journal they are
+    # applied to inventory_ref too, for the snapshot. New stock levels go
+    # to the stock listeners.
+    def run_batch(self, batch):
+        count = len(self.connections)
+        prepares = [[] for _ in range(count)]
+        for request, _ in batch:
+            if request[0] == 'checkout':
+                _, transaction_id, parts, _ = request
+                for shard, lines in parts.items():
+                    prepares[shard].append(('prepare', transaction_id, lines))
+        votes = [iter(answers) for answers in self.exchange(prepares)]
+
+        finals = [[] for _ in range(count)]
+        steps = []  # (request, future, shards asked in the final round, failed vote)
+        for request, future in batch:
+            if request[0] == 'checkout':
+                _, transaction_id, parts, _ = request
+                answers = {shard: next(votes[shard]) for shard in parts}
+                failed = next((payload for status, payload in answers.values() if status == 'error'), None)
+                if failed is None:
+                    asked = list(parts)
+                    for shard in asked:
+                        finals[shard].append(('commit', transaction_id, parts[shard]))
+                else:
+                    asked = [shard for shard, (status, _) in answers.items() if status == 'ok']
+                    for shard in asked:
+                        finals[shard].append(('abort', transaction_id))
+                steps.append((request, future, asked, failed))
+            else:
+                asked = range(count) if request[0] == 'items' else [shard_for(request[1], count)]
+                for shard in asked:
+                    finals[shard].append(request)
+                steps.append((request, future, asked, None))
+        replies = [iter(answers) for answers in self.exchange(finals)]
+
+        records = []
+        stock = []  # (item code, new quantity, sold out and removed)
+        outcomes = []  # (future, result, error, sale to record)
+        for request, future, asked, failed in steps:
+            answers = {shard: next(replies[shard]) for shard in asked}
+            op = request[0]
+            errors = {shard: payload for shard, (status, payload) in answers.items() if status == 'error'}
+            if op == 'checkout':
+                _, transaction_id, parts, lines = request
+                if failed is not None:
+                    outcomes.append((future, None, shard_error(failed), None))
+                    continue
+                # A shard that voted yes must commit; one that didn't leaves
+                # the sale half applied, so only committed parts are recorded
+                for shard in asked:
+                    if shard not in errors:
+                        records.append(('sell', tuple((code, quantity) for code, _, quantity in parts[shard])))
+                        stock.extend((code, quantity, quantity == 0) for code, quantity in answers[shard][1])
+                if errors:
+                    shard, payload = next(iter(errors.items()))
+                    error = ValueError(f"Transaction {transaction_id} failed to commit on shard {shard}: {payload[1]}")
+                    outcomes.append((future, None, error, None))
+                else:
+                    outcomes.append((future, transaction_id, None, (transaction_id, lines)))
+            elif errors:
+                outcomes.append((future, None, shard_error(next(iter(errors.values()))), None))
+            elif op == 'items':
+                merged = {}
+                for shard in sorted(answers):
+                    merged.update(answers[shard][1])
+                outcomes.append((future, merged, None, None))
+            else:
+                if op == 'adjust_quantity':
+                    records.append(('quantity', request[1], request[2]))
+                    stock.append((request[1], request[2], False))
+                elif op == 'adjust_price':
+                    records.append(('price', request[1], request[2]))
+                outcomes.append((future, answers[asked[0]][1], None, None))
+
+        if self.persist and records and not record_changes(records):
+            for record in records:
+                apply_journal_record(self.inventory, record)
+            request_sync()
+        for code, quantity, removed in stock:
+            record_stock(code, quantity)
+            if removed:
+                record_stock(code, None)
+        for future, result, error, sale in outcomes:
+            if sale is not None and sale_listeners:
+                record_sale(*sale)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def items(self):
+        return self.submit(('items',))
+
+    def add_to_cart(self, user_cart, item_code, quantity):
+        item = self.submit(('get', item_code))
+        if item is None:
+            raise KeyError("Item code not found in inventory")
+        add_to_cart_arg(user_cart, {item_code: Item.from_mapping(item)}, item_code, quantity)
+
+    def adjust_quantity(self, item_code, new_quantity):
+        self.submit(('adjust_quantity', item_code, new_quantity))
+
+    def adjust_price(self, item_code, new_price):
+        self.submit(('adjust_price', item_code, new_price))
+
+    # check out a cart across shards with two-phase commit.
+    # Returns a short transaction id and clears the cart.
+    # Raises like confirm_purchase_arg; no shard changes stock on failure.
+    def checkout(self, user_cart):
+        if not user_cart:
+            raise ValueError("Cart is empty")
+        transaction_id = str(uuid.uuid4())[:8]
+        parts = {}
+        for code, item in user_cart.items():
+            parts.setdefault(shard_for(code, len(self.connections)), []).append(
+                (code, item['Name'], item['Quantity']))
+        self.submit(('checkout', transaction_id, parts, sale_lines(user_cart)))
+        user_cart.clear()
+        return transaction_id
+
+    # finish the queued requests, copy the shards' stock back into
+    # inventory_ref, then stop the dispatcher and all workers.
+    # Only items that differ are changed, through journal records, and the
+    # stock listeners hear about each change.
+    # Returns the records. With persist they are already journaled;
+    # otherwise pass them to record_changes() on the thread that owns the
+    # store, which also commits SQLite and syncs the mmap file.
+    def close(self):
+        if self.dispatcher is None:
+            return []
+        final = self.items()
+        self.requests.put(None)
+        self.dispatcher.join()
+        self.dispatcher = None
+        records = [('remove', code) for code in self.inventory if code not in final]
+        for code, item in final.items():
+            current = self.inventory.get(code)
+            if current is None:
+                records.append(('add', code, item['Name'], item['Price'], item['Quantity']))
+                continue
+            if current['Price'] != item['Price']:
+                records.append(('price', code, item['Price']))
+            if current['Quantity'] != item['Quantity']:
+                records.append(('quantity', code, item['Quantity']))
+        for record in records:
+            apply_journal_record(self.inventory, record)
+            if record[0] in ('remove', 'add', 'quantity'):
+                record_stock(record[1], None if record[0] == 'remove' else record[-1])
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+        return records
+
+
 # ---------- Interactive / IO functions ----------
 # These functions use input() and print().
 # They form the main app and owner/user flows.
 
+# fancy_grid table that keeps every row formatted between renders.
+# Rows are keyed (e.g. by item code). update() re-formats a row only when its
+# values changed, and column widths come from per-column width counts that
+# each update adjusts, so one changed row never rescans the table.
+# Numbers are right aligned on the decimal point, text left aligned.
+class TableRenderer:
+    def __init__(self, headers):
+        self.headers = [str(header) for header in headers]
+        columns = range(len(self.headers))
+        self.rows = {}  # key -> (values, cells)
+        self.lines = {}  # key -> row line padded for self.layout
+        self.layout = None
+        self.text_widths = [Counter() for _ in columns]
+        self.int_widths = [Counter() for _ in columns]
+        self.frac_widths = [Counter() for _ in columns]
+        self.text_cells = [0 for _ in columns]  # non-numeric cells per column
+
+    def __len__(self):
+        return len(self.rows)
+
+    # add or replace the row stored under key.
+    def update(self, key, row):
+        values = tuple(row)
+        old = self.rows.get(key)
+        if old is not None:
+            if old[0] == values:
+                return
+            self.count(old[1], -1)
+        cells = tuple(format_cell(value) for value in values)
+        self.count(cells, 1)
+        self.rows[key] = (values, cells)
+        self.lines.pop(key, None)
+
+    # drop the row stored under key, if any.
+    def discard(self, key):
+        old = self.rows.pop(key, None)
+        if old is not None:
+            self.count(old[1], -1)
+            self.lines.pop(key, None)
+
+    # make the table hold exactly the given (key, row) pairs.
+    def sync(self, keyed_rows):
+        seen = set()
+        for key, row in keyed_rows:
+            self.update(key, row)
+            seen.add(key)
+        for key in [key for key in self.rows if key not in seen]:
+            self.discard(key)
+
+    # add (step 1) or remove (step -1) a row's cells from the width counts.
+    def count(self, cells, step):
+        for column, (text, whole, fraction) in enumerate(cells):
+            tally(self.text_widths[column], len(text), step)
+            if whole is None:
+                self.text_cells[column] += step
+            else:
+                tally(self.int_widths[column], len(whole), step)
+                tally(self.frac_widths[column], len(fraction), step)
+
+    # per column: (numeric, fraction width, width).
+    # Lines only need padding again when this changes.
+    def current_layout(self):
+        layout = []
+        for column, header in enumerate(self.headers):
+            numeric = bool(self.rows) and not self.text_cells[column]
+            if numeric:
+                fraction = max(self.frac_widths[column])
+                cells = max(self.int_widths[column]) + fraction
+            else:
+                fraction = 0
+                cells = max(self.text_widths[column], default=0)
+            layout.append((numeric, fraction, max(len(header) + 2, cells)))
+        return tuple(layout)
+
+    # render the rows for keys (default: all rows in insertion order).
+    # Only rows changed since the last render, or all rows after a column
+    # width change, are padded again.
+    def render(self, keys=None):
+        layout = self.current_layout()
+        if layout != self.layout:
+            self.lines.clear()
+            self.layout = layout
+        lines = []
+        for key in (self.rows if keys is None else keys):
+            line = self.lines.get(key)
+            if line is None:
+                line = self.lines[key] = pad_line(self.rows[key][1], layout)
+            lines.append(line)
+
+        widths = [width + 2 for _, _, width in layout]
+        header = "│ " + " │ ".join(
+            name.rjust(width) if numeric else name.ljust(width)
+            for name, (numeric, _, width) in zip(self.headers, layout)) + " │"
+        table = ["╒" + "╤".join("═" * width for width in widths) + "╕", header]
+        if lines:
+            table.append("╞" + "╪".join("═" * width for width in widths) + "╡")
+            separator = "\n├" + "┼".join("─" * width for width in widths) + "┤\n"
+            table.append(separator.join(lines))
+        table.append("╘" + "╧".join("═" * width for width in widths) + "╛")
+        return "\n".join(table)
+
+
+# format one table cell.
+# Returns (text, integer part, fraction part); the parts are None for text.
+def format_cell(value):
+    if value is None:
+        return "", None, None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value), None, None
+    text = str(value) if isinstance(value, int) else format(value, 'g')
+    whole, dot, fraction = text.partition('.')
+    return text, whole, dot + fraction
+
+
+# add step to counter[width], dropping widths no cell has any more.
+def tally(counter, width, step):
+    counter[width] += step
+    if not counter[width]:
+        del counter[width]
+
+
+# pad a row's cells into one table line for layout.
+def pad_line(cells, layout):
+    padded = []
+    for (text, whole, fraction), (numeric, fraction_width, width) in zip(cells, layout):
+        if numeric:
+            padded.append((whole + fraction.ljust(fraction_width)).rjust(width))
+        else:
+            padded.append(text.ljust(width))
+    return "│ " + " │ ".join(padded) + " │"
+
+
+# render rows as a one-off fancy_grid table.
+# Inputs: table_data rows, headers.
+def render_table(table_data, headers):
+    table = TableRenderer(headers)
+    for position, row in enumerate(table_data):
+        table.update(position, row)
+    return table.render()
+
+
+# owner inventory table, kept between displays so only changed rows re-render.
+inventory_table = TableRenderer(['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)'])
+
+# page, filters and sort order of the owner's inventory view.
+# Keys are the query_items_arg() keyword arguments.
+inventory_view = {'page': 1, 'page_size': PAGE_SIZE, 'low': None, 'high': None,
+                  'prefix': None, 'sort_by': 'code', 'descending': False}
+
+
+# render text as ASCII art, memoized in banner_cache.
+# Inputs: text, pyfiglet font name.
+# pyfiglet is only imported and the font only loaded on a cache miss.
+def render_banner(text, font='standard'):
+    global banner_cache
+    if banner_cache is None:
+        banner_cache = load_banner_cache()
+    key = (font, text)
+    if key not in banner_cache:
+        from pyfiglet import Figlet
+        banner_cache[key] = str(Figlet(font=font).renderText(text))
+        save_banner_cache(banner_cache)
+    return banner_cache[key]
+
+
+# read saved banners from BANNER_CACHE_FILE.
+# Returns {} if disabled, missing or unreadable.
+def load_banner_cache():
+    if not BANNER_CACHE_FILE:
+        return {}
+    try:
+        with open(BANNER_CACHE_FILE, 'rb') as f:
+            cache = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+# write banners to BANNER_CACHE_FILE.
+# The cache is only an optimization, so write errors are ignored.
+def save_banner_cache(cache):
+    if not BANNER_CACHE_FILE:
+        return
+    try:
+        with open(BANNER_CACHE_FILE, 'wb') as f:
+            pickle.dump(cache, f)
+    except OSError:
+        pass
+
+
 # prompt until positive int given.
 # Input: prompt string.
 # Returns a positive int.
@@ -152,8 +1843,25 @@ def main():
     global inventory
     owner_id, owner_password = setup_or_load_credentials()
     load_inventory()
+    open_low_stock()
+    ledger = open_sales_ledger()
+    open_sales_rollups(ledger)
+    open_best_sellers(ledger)
 
 
+    try:
+        run_menu(owner_id, owner_password)
+    finally:
+        # Also on Ctrl-C or an error: flush a group commit still waiting on
+        # its timer and the buffered sales.
+        if sync_timer is not None:
+            sync_now()
+        flush_sales()
+
+
+# main menu loop, until the user exits or a purchase ends the session.
+# Inputs: owner credentials.
+def run_menu(owner_id, owner_password):
     while True:
         try:
             print("Choose one among the following \n1.Owner(To manage)\n2.User(To purchase)\n3.Exit\n")
@@ -162,6 +1870,7 @@ def main():
             if user_input == 1:
                 if owner_lock(owner_id, owner_password):
                     load_inventory()
+                    open_low_stock()
                     if not inventory:
                         print("\n                 ~~~~ No inventory found. ~~~~")
                         print("   ~~~~ Your vending machine is empty. Please add items first. ~~~~")
@@ -192,14 +1901,12 @@ def main():
 # If not, prompt for new id and password and save them.
 def setup_or_load_credentials():
     if os.path.exists(CREDENTIALS_FILE):
-        f = Figlet(font='smslant')
-        print(f.renderText("Welcome back!"))
+        print(render_banner("Welcome back!", 'smslant'))
         with open(CREDENTIALS_FILE, 'rb') as f:
             owner_id, owner_password = pickle.load(f)
         return owner_id, owner_password
     else:
-        f = Figlet(font='smslant')
-        print(f.renderText("Welcome"))
+        print(render_banner("Welcome", 'smslant'))
         print("\nIt looks like you're setting up for the first time.")
         owner_id = input("Enter your new Owner ID: ").strip()
         owner_password = input("Enter your new password: ").strip()
@@ -226,39 +1933,1295 @@ def owner_lock(owner_id, owner_password):
 
 # load inventory from file if exists.
 # Sets global inventory dict.
+# The SQLite backend opens the database instead, importing the pickle once.
+# The binary backend converts an existing pickle snapshot on first start.
+# The mmap backend maps the binary file without reading every record.
+# Replays journal records written after the snapshot.
 def load_inventory():
-    global inventory
-    if os.path.exists(INVENTORY_FILE):
-        with open(INVENTORY_FILE, 'rb') as f:
-            inventory = pickle.load(f)
+    global inventory, journal_generation, journal_records
+    # A group commit still waiting would otherwise be lost with the old state
+    if sync_timer is not None:
+        sync_now()
+    if STORAGE_BACKEND == 'sqlite':
+        if not isinstance(inventory, SQLiteInventory):
+            new_db = not os.path.exists(SQLITE_FILE)
+            inventory = SQLiteInventory(SQLITE_FILE)
+            if new_db and (os.path.exists(INVENTORY_FILE) or os.path.exists(JOURNAL_FILE)):
+                count = migrate_pickle_to_sqlite(inventory)
+                print(f"\nImported {count} item(s) from {INVENTORY_FILE} into {SQLITE_FILE}.\n")
+        return
+    if STORAGE_BACKEND == 'mmap':
+        if not isinstance(inventory, MappedInventory):
+            inventory = open_mapped_inventory()
+        return
+    if STORAGE_BACKEND == 'binary' and not os.path.exists(BINARY_FILE) and os.path.exists(INVENTORY_FILE):
+        count = convert_pickle_to_binary(INVENTORY_FILE, BINARY_FILE)
+        print(f"\nConverted {count} item(s) from {INVENTORY_FILE} into {BINARY_FILE}.\n")
+    with journal_lock:
+        if os.path.exists(snapshot_file()) or os.path.exists(JOURNAL_FILE):
+            inventory, journal_generation = read_snapshot()
+            if INVENTORY_LAYOUT == 'columnar':
+                inventory = ColumnarInventory.from_mapping(inventory)
+            journal_records = replay_journal(inventory, journal_generation)
+    maybe_compact_journal()
 
 
 # save inventory to file.
 # Uses pickle to write current inventory.
+# The SQLite and mmap backends only commit their pending changes.
+# Starts a fresh journal since the snapshot now holds every change.
 def save_inventory():
-    global inventory
-    with open(INVENTORY_FILE, 'wb') as f:
-        pickle.dump(inventory, f)
+    global inventory, journal_generation, journal_records
+    if STORAGE_BACKEND in ('sqlite', 'mmap'):
+        cancel_sync()
+        inventory.commit()
+        print("\nInventory saved successfully.\n")
+        return
+    with journal_lock:
+        cancel_sync()
+        write_snapshot(inventory, journal_generation + 1)
+        journal_generation += 1
+        reset_journal()
+        journal_records = 0
     print("\nInventory saved successfully.\n")
 
 
-# owner menu to load, manage, display, or finish.
+# ---------- Durable writes ----------
+
+# write a file so a crash leaves either the old or the new contents.
+# Inputs: path, write function that gets the open temp file.
+# Writes a temp file next to path, fsyncs it, then renames it over path.
+def atomic_write(path, write):
+    temp_file = path + ".tmp"
+    try:
+        with open(temp_file, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        # open() itself may have failed, leaving no temp file
+        with suppress(FileNotFoundError):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, path)
+    fsync_directory(path)
+
+
+# fsync the directory holding path so a rename survives a crash.
+# Skipped where directories cannot be opened (Windows).
+def fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# write an inventory snapshot and its journal generation atomically.
+# Inputs: inventory_ref, generation.
+# Uses the binary layout when the binary backend is selected.
+def write_snapshot(inventory_ref, generation):
+    if STORAGE_BACKEND in ('binary', 'mmap'):
+        data = pack_binary_inventory(inventory_ref, generation)
+        atomic_write(BINARY_FILE, lambda f: f.write(data))
+        return
+
+    # Items are stored as plain dicts so the file does not depend on
+    # the module the Item class was loaded from.
+    items = {code: {"Name": item['Name'], "Price": item['Price'], "Quantity": item['Quantity']}
+             for code, item in inventory_ref.items()}
+
+    def write(f):
+        pickle.dump(items, f)
+        pickle.dump(generation, f)
+    atomic_write(INVENTORY_FILE, write)
+
+
+# make recent changes durable, sharing one fsync per commit window.
+# With GROUP_COMMIT_WINDOW at 0 the sync happens right away.
+# Otherwise the first call starts a timer and later calls ride along.
+def request_sync():
+    global sync_timer
+    if GROUP_COMMIT_WINDOW <= 0:
+        sync_now()
+        return
+    with journal_lock:
+        if sync_timer is None:
+            sync_timer = threading.Timer(GROUP_COMMIT_WINDOW, sync_now)
+            sync_timer.daemon = True
+            sync_timer.start()
+
+
+# flush pending changes to disk now.
+# Journal mode fsyncs the journal. Otherwise a full snapshot is written.
+# The mmap backend flushes its dirty pages.
+def sync_now():
+    global journal_generation
+    with journal_lock:
+        cancel_sync()
+        if STORAGE_BACKEND == 'mmap':
+            inventory.commit()
+        elif JOURNAL_MODE:
+            if os.path.exists(JOURNAL_FILE):
+                with open(JOURNAL_FILE, 'ab') as f:
+                    os.fsync(f.fileno())
+        else:
+            write_snapshot(dict(inventory), journal_generation + 1)
+            journal_generation += 1
+            reset_journal()
+
+
+# drop the pending group commit timer.
+# Callers that write a full snapshot make it redundant.
+def cancel_sync():
+    global sync_timer
+    with journal_lock:
+        if sync_timer is not None:
+            sync_timer.cancel()
+            sync_timer = None
+
+
+# ---------- Inventory journal ----------
+# Records are plain tuples, pickled one after another:
+#   ('generation', n)                      first record, matches the snapshot
+#   ('sell', ((code, quantity), ...))      one confirmed purchase
+#   ('quantity', code, new_quantity)       restock or quantity change
+#   ('price', code, new_price)             price change
+#   ('add', code, name, price, quantity)   new item
+#   ('remove', code)                       item removed by the owner
+#   ('scale_prices', percent)              every price changed by percent
+
+# snapshot file for the selected storage backend.
+def snapshot_file():
+    return BINARY_FILE if STORAGE_BACKEND in ('binary', 'mmap') else INVENTORY_FILE
+
+
+# read the snapshot file.
+# Returns (inventory dict, journal generation).
+# Missing file gives an empty inventory at generation 0.
+# Binary snapshots load straight into columns for the columnar layout.
+def read_snapshot():
+    if STORAGE_BACKEND in ('binary', 'mmap'):
+        if INVENTORY_LAYOUT == 'columnar':
+            return read_binary_columnar(BINARY_FILE)
+        return read_binary_inventory(BINARY_FILE)
+    return read_pickle_inventory(INVENTORY_FILE)
+
+
+# read a pickle snapshot.
+# Input: path.
+# Returns (Inventory of Items, journal generation).
+def read_pickle_inventory(path):
+    if not os.path.exists(path):
+        return Inventory(), 0
+    with open(path, 'rb') as f:
+        items = pickle.load(f)
+        # Newer snapshots carry the journal generation after the dict.
+        try:
+            generation = pickle.load(f)
+        except EOFError:
+            generation = 0
+    return Inventory((code, Item.from_mapping(item)) for code, item in items.items()), generation
+
+
+# replay the journal over a snapshot.
+# Inputs: inventory_ref, generation of that snapshot.
+# A journal from another generation is already folded in and is skipped.
+# Returns the number of records applied.
+def replay_journal(inventory_ref, generation):
+    records = read_journal()
+    if next(records, None) != ('generation', generation):
+        return 0
+    count = 0
+    for record in records:
+        apply_journal_record(inventory_ref, record)
+        count += 1
+    return count
+
+
+# start an empty journal for the current snapshot generation.
+# Written with atomic_write(), so old records vanish atomically.
+def reset_journal():
+    atomic_write(JOURNAL_FILE, lambda f: pickle.dump(('generation', journal_generation), f))
+
+
+# append change records to the journal.
+# Input: iterable of record tuples.
+# Writes a generation header first if the journal does not exist yet.
+# Starts a background compaction once the journal is over its limits.
+def append_journal(records):
+    global journal_records
+    with journal_lock:
+        if not os.path.exists(JOURNAL_FILE):
+            reset_journal()
+        with open(JOURNAL_FILE, 'ab') as f:
+            for record in records:
+                pickle.dump(record, f)
+                journal_records += 1
+    maybe_compact_journal()
+
+
+# check if the journal is over its record or size limit.
+# Returns True when a compaction is due.
+def journal_needs_compaction():
+    if journal_records >= JOURNAL_MAX_RECORDS:
+        return True
+    return os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) >= JOURNAL_MAX_BYTES
+
+
+# fold the journal into a fresh snapshot.
+# Rebuilds state from the files, not the live inventory, so it is safe
+# to run while the app keeps selling.
+# The new snapshot is renamed into place before the journal is reset;
+# a crash in between leaves a journal of an old generation, which is ignored.
+def compact_journal():
+    global journal_generation, journal_records
+    with journal_lock:
+        inventory_ref, generation = read_snapshot()
+        replay_journal(inventory_ref, generation)
+        write_snapshot(inventory_ref, generation + 1)
+        journal_generation = generation + 1
+        reset_journal()
+        journal_records = 0
+
+
+# start compact_journal() in a background thread if due.
+# Does nothing while a compaction is already running.
+def maybe_compact_journal():
+    global compactor_thread
+    if not journal_needs_compaction():
+        return
+    if compactor_thread is not None and compactor_thread.is_alive():
+        return
+    compactor_thread = threading.Thread(target=compact_journal, daemon=True)
+    compactor_thread.start()
+
+
+# read journal records in order.
+# Yields each record tuple, starting with the generation header.
+# Stops quietly at a torn record left by a crash mid-append.
+def read_journal():
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    with open(JOURNAL_FILE, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except (EOFError, ValueError, pickle.UnpicklingError):
+                return
+
+
+# build the journal record for a purchase.
+# Input: user_cart before it is cleared.
+# Returns a 'sell' record with (code, quantity) pairs.
+def purchase_record(user_cart):
+    return ('sell', tuple((code, item['Quantity']) for code, item in user_cart.items()))
+
+
+# apply one journal record to an inventory dict.
+# Inputs: inventory_ref, record tuple.
+# Sold out items are removed, like confirm_purchase_arg does.
+# Records for codes that no longer exist are skipped.
+def apply_journal_record(inventory_ref, record):
+    op = record[0]
+    if op == 'sell':
+        for code, quantity in record[1]:
+            if code in inventory_ref:
+                inventory_ref[code]['Quantity'] -= quantity
+                if inventory_ref[code]['Quantity'] <= 0:
+                    del inventory_ref[code]
+    elif op == 'quantity':
+        if record[1] in inventory_ref:
+            inventory_ref[record[1]]['Quantity'] = record[2]
+    elif op == 'price':
+        if record[1] in inventory_ref:
+            inventory_ref[record[1]]['Price'] = record[2]
+    elif op == 'add':
+        _, code, name, price, quantity = record
+        inventory_ref[code] = Item(name, price, quantity)
+    elif op == 'remove':
+        inventory_ref.pop(record[1], None)
+    elif op == 'scale_prices':
+        adjust_all_prices_arg(inventory_ref, record[1])
+    else:
+        raise ValueError(f"Unknown journal record {op!r}")
+
+
+# persist one change the way the storage backend wants it.
+# Input: journal record tuple describing the change.
+# Returns False when the change still needs a snapshot write.
+def record_change(record):
+    return record_changes([record])
+
+
+# persist several changes with a single write.
+# Input: list of journal record tuples.
+# SQLite commits its open transaction. The mmap backend already wrote the
+# changes in place and only asks for a (group) sync. Journal mode appends
+# the records and asks for a sync.
+# Returns False when the changes still need a snapshot write.
+def record_changes(records):
+    if STORAGE_BACKEND == 'sqlite':
+        inventory.commit()
+        return True
+    if STORAGE_BACKEND == 'mmap':
+        request_sync()
+        return True
+    if JOURNAL_MODE:
+        append_journal(records)
+        request_sync()
+        return True
+    return False
+
+
+# persist changes, writing a snapshot if the backend has no journal.
+# Input: list of journal record tuples.
+def persist_changes(records):
+    if not record_changes(records):
+        request_sync()
+
+
+# check out a queue of carts against the global inventory.
+# Input: list of user_carts (e.g. carts collected offline by a kiosk).
+# Applies the accepted carts with confirm_purchases_batch_arg() and
+# persists them all with one write.
+# Returns the per-cart results of confirm_purchases_batch_arg().
+def checkout_batch(user_carts):
+    records = [purchase_record(user_cart) for user_cart in user_carts]
+    results = confirm_purchases_batch_arg(user_carts, inventory)
+    accepted = [record for record, (status, _) in zip(records, results) if status == 'accepted']
+    if accepted and not record_changes(accepted):
+        request_sync()
+    return results
+
+
+# ---------- Sales ledger ----------
+
+# append-only record of every confirmed purchase.
+# append() has the sale listener signature and only packs the sale into a
+# buffer; flush() writes the buffer to the newest segment with one write and
+# fsync. read() streams the records back segment by segment, so the whole
+# history is never held in memory.
+class SalesLedger:
+    def __init__(self, directory=LEDGER_DIR, segment_bytes=LEDGER_SEGMENT_BYTES,
+                 buffer_bytes=LEDGER_BUFFER_BYTES, flush_seconds=LEDGER_FLUSH_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.buffer_bytes = buffer_bytes
+        self.flush_seconds = flush_seconds
+        self.buffer = bytearray()
+        self.flush_timer = None
+        self.lock = threading.Lock()
+        numbers = self.segment_numbers()
+        self.segment = numbers[-1] if numbers else 1
+        self.segment_size = self.recover(self.segment_path(self.segment))
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"sales-{number:08d}.ledger")
+
+    def segment_numbers(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r"sales-(\d{8})\.ledger", name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    # cut a torn record off the end of a segment left by a crash.
+    # Returns the segment's size, 0 if it doesn't exist.
+    def recover(self, path):
+        if not os.path.exists(path):
+            return 0
+        end = 0
+        if os.path.getsize(path) >= LEDGER_HEADER.size:
+            end = LEDGER_HEADER.size
+            with open(path, 'rb') as f:
+                for _ in read_ledger_segment(f):
+                    end = f.tell()
+        if end != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+        return end
+
+    # buffer one sale; lines are (item code, quantity, unit price).
+    # The buffer is written once full, or flush_seconds after its first
+    # sale by a timer, so a quiet machine does not hold sales in memory.
+    def append(self, transaction_id, timestamp, lines):
+        record = LEDGER_RECORD.pack(transaction_id.encode('ascii'), timestamp, len(lines)) + b"".join(
+            LEDGER_LINE.pack(code, quantity, round(price * 100)) for code, quantity, price in lines)
+        with self.lock:
+            self.buffer += record
+            if len(self.buffer) >= self.buffer_bytes:
+                self.write_buffer()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_seconds, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    # write buffered sales to disk.
+    def flush(self):
+        with self.lock:
+            self.write_buffer()
+
+    # write the buffer to the newest segment, starting a new one if it is full.
+    # Caller holds self.lock.
+    def write_buffer(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.buffer:
+            return
+        if self.segment_size >= self.segment_bytes:
+            self.segment += 1
+            self.segment_size = 0
+        with open(self.segment_path(self.segment), 'ab') as f:
+            if self.segment_size == 0:
+                f.write(LEDGER_HEADER.pack(LEDGER_MAGIC, LEDGER_VERSION))
+            f.write(self.buffer)
+            f.flush()
+            os.fsync(f.fileno())
+            self.segment_size = f.tell()
+        self.buffer.clear()
+
+    # (segment, offset) just past the last written sale.
+    def position(self):
+        with self.lock:
+            self.write_buffer()
+            return self.segment, self.segment_size
+
+    # yield (transaction id, timestamp, lines) for every sale, oldest first.
+    # Input: optional position() to start from instead of the beginning.
+    # Buffered sales are flushed first so they are included.
+    def read(self, start=None):
+        self.flush()
+        first, offset = start or (0, 0)
+        for number in self.segment_numbers():
+            if number < first:
+                continue
+            with open(self.segment_path(number), 'rb') as f:
+                yield from read_ledger_segment(f, offset if number == first else 0)
+
+
+# yield the sales stored in one open ledger segment.
+# Input: open file, optional offset of the first record to read.
+# Stops at a torn record at the end. Raises ValueError for a foreign file.
+def read_ledger_segment(f, offset=0):
+    header = f.read(LEDGER_HEADER.size)
+    if not header:
+        return
+    if len(header) < LEDGER_HEADER.size or LEDGER_HEADER.unpack(header) != (LEDGER_MAGIC, LEDGER_VERSION):
+        raise ValueError("Not a sales ledger segment")
+    if offset > LEDGER_HEADER.size:
+        f.seek(offset)
+    while True:
+        head = f.read(LEDGER_RECORD.size)
+        if len(head) < LEDGER_RECORD.size:
+            return
+        transaction_id, timestamp, count = LEDGER_RECORD.unpack(head)
+        body = f.read(count * LEDGER_LINE.size)
+        if len(body) < count * LEDGER_LINE.size:
+            return
+        lines = tuple((code, quantity, cents / 100) for code, quantity, cents in LEDGER_LINE.iter_unpack(body))
+        yield transaction_id.rstrip(b"\0").decode('ascii'), timestamp, lines
+
+
+# open the sales ledger and record every sale in it from now on.
+def open_sales_ledger():
+    global sales_ledger
+    if sales_ledger is None:
+        sales_ledger = SalesLedger(LEDGER_DIR)
+        sale_listeners.append(sales_ledger.append)
+    return sales_ledger
+
+
+# running sales totals: per item per hour, per item per day, and overall.
+# add() has the sale listener signature and costs O(cart), so reports never
+# scan the sales history. Money is kept in whole cents.
+# Hours are counted from the epoch; days are local calendar days.
+class SalesRollups:
+    def __init__(self):
+        self.hourly = {}  # hour number -> {item code: [units, cents]}
+        self.daily = {}  # date ordinal -> {item code: [units, cents]}
+        self.totals = {}  # item code -> [units, cents]
+        self.hourly_cents = {}  # hour number -> cents
+        self.daily_cents = {}  # date ordinal -> cents
+        # units per item per hour it sold in, as parallel arrays oldest first,
+        # for the forecast; slots maps the codes of slot_hour to their entry
+        self.sale_codes = array('q')
+        self.sale_hours = array('q')
+        self.sale_units = array('q')
+        self.slot_hour = None
+        self.slots = {}
+        self.sales = 0
+        self.cents = 0
+        self.position = None  # ledger position() these totals cover
+
+    def add(self, transaction_id, timestamp, lines):
+        hour = int(timestamp // 3600)
+        day = datetime.fromtimestamp(timestamp).toordinal()
+        hourly = self.hourly.setdefault(hour, {})
+        daily = self.daily.setdefault(day, {})
+        if hour != self.slot_hour:
+            self.slot_hour, self.slots = hour, {}
+        sale_cents = 0
+        for code, quantity, price in lines:
+            cents = round(price * 100) * quantity
+            sale_cents += cents
+            slot = self.slots.get(code)
+            if slot is None:
+                self.slots[code] = len(self.sale_codes)
+                self.sale_codes.append(code)
+                self.sale_hours.append(hour)
+                self.sale_units.append(quantity)
+            else:
+                self.sale_units[slot] += quantity
+            for bucket in (hourly, daily, self.totals):
+                counts = bucket.get(code)
+                if counts is None:
+                    bucket[code] = [quantity, cents]
+                else:
+                    counts[0] += quantity
+                    counts[1] += cents
+        self.hourly_cents[hour] = self.hourly_cents.get(hour, 0) + sale_cents
+        self.daily_cents[day] = self.daily_cents.get(day, 0) + sale_cents
+        self.sales += 1
+        self.cents += sale_cents
+
+    # best selling items as (item code, units, revenue), best first.
+    # Inputs: k, by 'units' or 'revenue'.
+    def top_sellers(self, k=5, by='units'):
+        field = 0 if by == 'units' else 1
+        best = heapq.nlargest(k, self.totals.items(), key=lambda entry: (entry[1][field], -entry[0]))
+        return [(code, units, cents / 100) for code, (units, cents) in best]
+
+    # revenue of one local day (a date) or of the current day.
+    def revenue_on(self, day=None):
+        day = (day or datetime.now()).toordinal()
+        return self.daily_cents.get(day, 0) / 100
+
+    # average units of an item sold per day over the last days, today included.
+    # Usable as LowStockQueue's daily_rate.
+    def units_per_day(self, code, days=7, today=None):
+        day = (today or datetime.now()).toordinal()
+        return sum(self.daily.get(day - back, {}).get(code, (0, 0))[0] for back in range(days)) / days
+
+    # revenue of the last n hours, including the current one.
+    def revenue_last_hours(self, hours=24, now=None):
+        hour = int((time.time() if now is None else now) // 3600)
+        return sum(self.hourly_cents.get(hour - back, 0) for back in range(hours)) / 100
+
+    # drop hourly and daily buckets and sale entries too old to be read.
+    # Input: optional now (unix time).
+    # Sale entries are in time order, so the old ones are a prefix.
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        oldest_hour = int(now // 3600) - FORECAST_HISTORY_HOURS + 1
+        oldest_day = datetime.fromtimestamp(now).toordinal() - ROLLUP_RETENTION_DAYS + 1
+        for buckets, oldest in ((self.hourly, oldest_hour), (self.hourly_cents, oldest_hour),
+                                (self.daily, oldest_day), (self.daily_cents, oldest_day)):
+            for key in [key for key in buckets if key < oldest]:
+                del buckets[key]
+        old = bisect.bisect_left(self.sale_hours, oldest_hour)
+        for column in (self.sale_codes, self.sale_hours, self.sale_units):
+            del column[:old]
+        self.slots = {code: slot - old for code, slot in self.slots.items() if slot >= old}
+
+    # saved as a plain dict, like the inventory snapshot.
+    def save(self, path):
+        atomic_write(path, lambda f: pickle.dump(vars(self), f))
+
+
+# load the saved rollups and bring them up to date with the ledger.
+# Only sales after the saved ledger position are replayed. From then on
+# every sale also updates the rollups.
+def open_sales_rollups(ledger):
+    global sales_rollups
+    if sales_rollups is None:
+        rollups = SalesRollups()
+        try:
+            with open(ROLLUP_FILE, 'rb') as f:
+                state = pickle.load(f)
+            if isinstance(state, dict) and state.keys() == vars(rollups).keys():
+                vars(rollups).update(state)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+        for sale in ledger.read(rollups.position):
+            rollups.add(*sale)
+        sales_rollups = rollups
+        sale_listeners.append(sales_rollups.add)
+    return sales_rollups
+
+
+# approximate heaviest items of a weighted stream in fixed memory.
+# Space-Saving: at most capacity items have a counter. An untracked item
+# takes over the smallest counter and inherits its count as possible
+# overcount, so counts are never too low and every item above
+# total / capacity is tracked. The smallest counter comes from a lazy
+# min-heap of (count, code); stale entries are skipped, and the heap is
+# rebuilt from the counters when it passes 4 * capacity entries.
+class HeavyHitters:
+    def __init__(self, capacity=HEAVY_HITTER_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}  # item code -> [count, possible overcount]
+        self.heap = []
+        self.total = 0
+
+    def add(self, code, weight=1):
+        self.total += weight
+        counter = self.counts.get(code)
+        if counter is None:
+            if len(self.counts) < self.capacity:
+                counter = self.counts[code] = [0, 0]
+            else:
+                floor, smallest = self.pop_smallest()
+                del self.counts[smallest]
+                counter = self.counts[code] = [floor, floor]
+        counter[0] += weight
+        heapq.heappush(self.heap, (counter[0], code))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, code) for code, (count, _) in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    # (count, code) of the smallest counter, taken off the heap.
+    def pop_smallest(self):
+        while True:
+            count, code = heapq.heappop(self.heap)
+            counter = self.counts.get(code)
+            if counter is not None and counter[0] == count:
+                return count, code
+
+    # k heaviest items as (item code, count, possible overcount).
+    def top(self, k):
+        best = heapq.nlargest(k, self.counts.items(), key=lambda entry: (entry[1][0], -entry[0]))
+        return [(code, count, error) for code, (count, error) in best]
+
+
+# best sellers by units and by revenue, in constant memory.
+# add() has the sale listener signature, so it sees every checkout.
+class BestSellers:
+    def __init__(self, capacity=HEAVY_HITTER_CAPACITY):
+        self.units = HeavyHitters(capacity)
+        self.revenue = HeavyHitters(capacity)  # in cents
+        self.position = None  # ledger position() the counters cover
+
+    def add(self, transaction_id, timestamp, lines):
+        for code, quantity, price in lines:
+            self.units.add(code, quantity)
+            self.revenue.add(code, round(price * 100) * quantity)
+
+    # k best sellers as (item code, units or revenue, possible overcount).
+    # Input: by 'units' or 'revenue'.
+    def top(self, k=5, by='units'):
+        if by == 'units':
+            return self.units.top(k)
+        return [(code, cents / 100, error / 100) for code, cents, error in self.revenue.top(k)]
+
+    # saved as plain dicts, like the rollups.
+    def save(self, path):
+        state = {'units': vars(self.units), 'revenue': vars(self.revenue), 'position': self.position}
+        atomic_write(path, lambda f: pickle.dump(state, f))
+
+
+# load the saved best seller counters and catch up with the ledger.
+# Like the rollups, only sales after the saved position are replayed, and
+# the whole ledger on first start. A file saved with another capacity is
+# ignored, as its counters would not be bounded by the new one.
+def open_best_sellers(ledger):
+    global best_sellers
+    if best_sellers is None:
+        sellers = BestSellers(HEAVY_HITTER_CAPACITY)
+        try:
+            with open(BEST_SELLERS_FILE, 'rb') as f:
+                state = pickle.load(f)
+            if (isinstance(state, dict) and state.keys() == {'units', 'revenue', 'position'}
+                    and state['units'].keys() == vars(sellers.units).keys()
+                    and state['units']['capacity'] == state['revenue']['capacity'] == HEAVY_HITTER_CAPACITY):
+                vars(sellers.units).update(state['units'])
+                vars(sellers.revenue).update(state['revenue'])
+                sellers.position = state['position']
+        except (OSError, EOFError, ValueError, AttributeError, pickle.UnpicklingError):
+            pass
+        for sale in ledger.read(sellers.position):
+            sellers.add(*sale)
+        best_sellers = sellers
+        sale_listeners.append(best_sellers.add)
+    return best_sellers
+
+
+# write buffered sales, then the rollups and best sellers that now cover
+# all of them. Old buckets are pruned first, so the saved rollups stay
+# bounded. Holds listener_lock so no sale lands in between.
+def flush_sales():
+    with listener_lock:
+        position = sales_ledger.position()
+        if sales_rollups is not None:
+            sales_rollups.position = position
+            sales_rollups.prune()
+            sales_rollups.save(ROLLUP_FILE)
+        if best_sellers is not None:
+            best_sellers.position = position
+            best_sellers.save(BEST_SELLERS_FILE)
+
+
+# ---------- Binary snapshot ----------
+
+# pack an inventory into the binary snapshot layout.
+# Inputs: inventory_ref, journal generation.
+# Returns bytes. Prices are stored as whole cents.
+# Raises ValueError if a value does not fit its field.
+def pack_binary_inventory(inventory_ref, generation=0):
+    codes = sorted(inventory_ref)
+    records = bytearray(BINARY_RECORD.size * len(codes))
+    names = bytearray()
+    try:
+        for row, code in enumerate(codes):
+            item = inventory_ref[code]
+            name = item['Name'].encode('utf-8')
+            BINARY_RECORD.pack_into(records, row * BINARY_RECORD.size, code, round(item['Price'] * 100),
+                                    item['Quantity'], len(names), len(name), 0)
+            names += name
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, generation,
+                                    len(codes), len(codes), len(names))
+    except struct.error as e:
+        raise ValueError(f"Inventory does not fit the binary format: {e}")
+    return header + records + names
+
+
+# unpack a binary snapshot.
+# Input: bytes read from a binary snapshot file.
+# Returns (inventory dict, journal generation). Tombstones are skipped.
+# Raises ValueError for a bad magic number or unknown version.
+def unpack_binary_inventory(data):
+    magic, version, _, generation, count, _, _ = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary inventory file")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary inventory version {version}")
+    view = memoryview(data)
+    records_end = BINARY_HEADER.size + count * BINARY_RECORD.size
+    strings = view[records_end:]
+    inventory_ref = Inventory()
+    for code, cents, quantity, offset, length, flags in BINARY_RECORD.iter_unpack(view[BINARY_HEADER.size:records_end]):
+        if flags & RECORD_DELETED:
+            continue
+        inventory_ref[code] = Item(str(strings[offset:offset + length], 'utf-8'), cents / 100, quantity)
+    return inventory_ref, generation
+
+
+# read a binary snapshot with one bulk read.
+# Input: path.
+# Returns (inventory dict, journal generation).
+def read_binary_inventory(path):
+    if not os.path.exists(path):
+        return Inventory(), 0
+    with open(path, 'rb') as f:
+        return unpack_binary_inventory(f.read())
+
+
+# convert a pickle snapshot into a binary snapshot.
+# Inputs: pickle path, binary path.
+# Keeps the journal generation so the current journal still applies.
+# Returns the number of items converted.
+def convert_pickle_to_binary(pickle_path, binary_path):
+    inventory_ref, generation = read_pickle_inventory(pickle_path)
+    data = pack_binary_inventory(inventory_ref, generation)
+    atomic_write(binary_path, lambda f: f.write(data))
+    return len(inventory_ref)
+
+
+# ---------- Memory-mapped binary inventory ----------
+
+# inventory backed by a memory-mapped binary snapshot.
+# Behaves like the inventory dict without loading it. Lookups binary search
+# the sorted records; quantity and price writes and removals (tombstones)
+# change the mapped bytes in place. Adding a new code rewrites the file.
+class MappedInventory(MutableMapping):
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, _, _, self.count, _, _ = BINARY_HEADER.unpack_from(self.map)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a binary inventory file")
+        if version != BINARY_VERSION:
+            raise ValueError(f"Unsupported binary inventory version {version}")
+        self.strings = BINARY_HEADER.size + self.count * BINARY_RECORD.size
+
+    # byte offset of a record.
+    def offset(self, row):
+        return BINARY_HEADER.size + row * BINARY_RECORD.size
+
+    # find the live record for a code by binary search.
+    # Returns the row number or None.
+    def find(self, code):
+        if not isinstance(code, int):
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<Q', self.map, self.offset(middle))[0] < code:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        found, _, _, _, _, flags = BINARY_RECORD.unpack_from(self.map, self.offset(low))
+        if found != code or flags & RECORD_DELETED:
+            return None
+        return low
+
+    def header_field(self, index, value=None):
+        fields = list(BINARY_HEADER.unpack_from(self.map))
+        if value is not None:
+            fields[index] = value
+            BINARY_HEADER.pack_into(self.map, 0, *fields)
+        return fields[index]
+
+    @property
+    def generation(self):
+        return self.header_field(3)
+
+    @generation.setter
+    def generation(self, value):
+        self.header_field(3, value)
+
+    def __getitem__(self, code):
+        row = self.find(code)
+        if row is None:
+            raise KeyError(code)
+        return MappedItem(self, row)
+
+    def __setitem__(self, code, item):
+        row = self.find(code)
+        if row is not None and self.read_name(row) == item['Name']:
+            current = MappedItem(self, row)
+            current['Price'] = item['Price']
+            current['Quantity'] = item['Quantity']
+            return
+        # New codes need a slot in the sorted records: rewrite the file.
+        inventory_ref = {key: dict(value) for key, value in self.items()}
+        inventory_ref[code] = dict(item)
+        data = pack_binary_inventory(inventory_ref, self.generation)
+        self.close()
+        atomic_write(self.path, lambda f: f.write(data))
+        self._open()
+
+    def __delitem__(self, code):
+        row = self.find(code)
+        if row is None:
+            raise KeyError(code)
+        flags_offset = self.offset(row) + BINARY_RECORD.size - 2
+        flags = struct.unpack_from('<H', self.map, flags_offset)[0]
+        struct.pack_into('<H', self.map, flags_offset, flags | RECORD_DELETED)
+        self.header_field(5, self.header_field(5) - 1)
+
+    def __iter__(self):
+        for row in range(self.count):
+            code, _, _, _, _, flags = BINARY_RECORD.unpack_from(self.map, self.offset(row))
+            if not flags & RECORD_DELETED:
+                yield code
+
+    def __len__(self):
+        return self.header_field(5)
+
+    def read_name(self, row):
+        _, _, _, name_offset, length, _ = BINARY_RECORD.unpack_from(self.map, self.offset(row))
+        start = self.strings + name_offset
+        return str(self.map[start:start + length], 'utf-8')
+
+    # flush dirty pages to the file.
+    def commit(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+# one record of MappedInventory.
+# Reads and writes go straight to the mapped bytes.
+class MappedItem(Mapping):
+    # byte position of each numeric field inside a record
+    FIELDS = {'Price': (8, '<q'), 'Quantity': (16, '<I')}
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        if key == 'Name':
+            return self.store.read_name(self.row)
+        position, fmt = self.FIELDS[key]
+        value = struct.unpack_from(fmt, self.store.map, self.store.offset(self.row) + position)[0]
+        return value / 100 if key == 'Price' else value
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise ValueError(f"{key} cannot be changed in place")
+        position, fmt = self.FIELDS[key]
+        if key == 'Price':
+            value = round(value * 100)
+        try:
+            struct.pack_into(fmt, self.store.map, self.store.offset(self.row) + position, value)
+        except struct.error as e:
+            raise ValueError(f"{key} out of range: {e}")
+
+    def __iter__(self):
+        return iter(('Name', 'Price', 'Quantity'))
+
+    def __len__(self):
+        return 3
+
+
+# open BINARY_FILE as a MappedInventory.
+# Creates it from the pickle snapshot (or empty) on first start, and folds
+# in any journal records left for its generation.
+def open_mapped_inventory():
+    global journal_generation
+    if not os.path.exists(BINARY_FILE):
+        convert_pickle_to_binary(INVENTORY_FILE, BINARY_FILE)
+    store = MappedInventory(BINARY_FILE)
+    with journal_lock:
+        journal_generation = store.generation
+        if replay_journal(store, journal_generation):
+            journal_generation += 1
+            store.generation = journal_generation
+            store.commit()
+            reset_journal()
+    return store
+
+
+# ---------- Columnar inventory ----------
+
+# inventory kept as NumPy columns.
+# codes, prices and quantities live in contiguous arrays with a code -> row
+# index; names stay in a list. Behaves like the inventory dict, and adds
+# vectorized total_value(), scale_prices() and rows().
+# Removing an item moves the last row into its slot.
+class ColumnarInventory(MutableMapping):
+    def __init__(self, capacity=16):
+        import numpy as np
+        self.codes = np.zeros(capacity, dtype=np.int64)
+        self.prices = np.zeros(capacity, dtype=np.float64)
+        self.quantities = np.zeros(capacity, dtype=np.int64)
+        self.names = []
+        self.index = {}
+        self.name_index = {}  # casefolded name -> code
+
+    # build a columnar store from any inventory mapping.
+    @classmethod
+    def from_mapping(cls, inventory_ref):
+        store = cls(max(16, len(inventory_ref)))
+        for code, item in inventory_ref.items():
+            store[code] = item
+        return store
+
+    # build a columnar store from arrays without per-item work.
+    @classmethod
+    def from_columns(cls, codes, names, prices, quantities):
+        import numpy as np
+        store = cls(0)
+        store.codes = np.array(codes, dtype=np.int64)
+        store.prices = np.array(prices, dtype=np.float64)
+        store.quantities = np.array(quantities, dtype=np.int64)
+        store.names = list(names)
+        store.index = {code: row for row, code in enumerate(store.codes.tolist())}
+        store.name_index = {name.casefold(): code for code, name in zip(store.index, store.names)}
+        return store
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, code):
+        if code not in self.index:
+            raise KeyError(code)
+        return ColumnarItem(self, code)
+
+    def __setitem__(self, code, item):
+        row = self.index.get(code)
+        if row is None:
+            row = len(self.names)
+            if row == len(self.codes):
+                self.grow()
+            self.index[code] = row
+            self.names.append(item['Name'])
+            self.codes[row] = code
+        else:
+            self.unindex(row)
+            self.names[row] = item['Name']
+        self.name_index[item['Name'].casefold()] = code
+        self.prices[row] = item['Price']
+        self.quantities[row] = item['Quantity']
+
+    def __delitem__(self, code):
+        self.unindex(self.index[code])
+        row = self.index.pop(code)
+        last = len(self.names) - 1
+        if row != last:
+            self.codes[row] = self.codes[last]
+            self.prices[row] = self.prices[last]
+            self.quantities[row] = self.quantities[last]
+            self.names[row] = self.names[last]
+            self.index[int(self.codes[row])] = row
+        self.names.pop()
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def __iter__(self):
+        return iter(self.codes[:len(self.names)].tolist())
+
+    def unindex(self, row):
+        key = self.names[row].casefold()
+        if self.name_index.get(key) == int(self.codes[row]):
+            del self.name_index[key]
+
+    def code_for_name(self, name):
+        return self.name_index.get(name.casefold())
+
+    # double the array capacity.
+    def grow(self):
+        import numpy as np
+        capacity = max(16, 2 * len(self.codes))
+        for column in ('codes', 'prices', 'quantities'):
+            old = getattr(self, column)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, column, new)
+
+    def total_value(self):
+        import numpy as np
+        size = len(self.names)
+        return float(np.dot(self.prices[:size], self.quantities[:size]))
+
+    def scale_prices(self, factor):
+        import numpy as np
+        size = len(self.names)
+        self.prices[:size] = np.round(self.prices[:size] * factor, 2)
+
+    # table rows [code, name, price, quantity] in row order.
+    def rows(self):
+        size = len(self.names)
+        return [list(row) for row in zip(self.codes[:size].tolist(), self.names,
+                                         self.prices[:size].tolist(), self.quantities[:size].tolist())]
+
+
+# one item of ColumnarInventory.
+# Looks its row up by code on each access, since removals move rows.
+class ColumnarItem(Mapping):
+    def __init__(self, store, code):
+        self.store = store
+        self.code = code
+
+    def __getitem__(self, key):
+        row = self.store.index[self.code]
+        if key == 'Name':
+            return self.store.names[row]
+        if key == 'Price':
+            return float(self.store.prices[row])
+        if key == 'Quantity':
+            return int(self.store.quantities[row])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        row = self.store.index[self.code]
+        if key == 'Price':
+            self.store.prices[row] = value
+        elif key == 'Quantity':
+            self.store.quantities[row] = value
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(('Name', 'Price', 'Quantity'))
+
+    def __len__(self):
+        return 3
+
+
+# read a binary snapshot straight into a ColumnarInventory.
+# Input: path.
+# Uses one bulk read and a NumPy view of the fixed-width records
+# (a dtype laid out like BINARY_RECORD).
+# Returns (ColumnarInventory, journal generation).
+def read_binary_columnar(path):
+    if not os.path.exists(path):
+        return ColumnarInventory(), 0
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, _, generation, count, _, _ = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Not a supported binary inventory file")
+    import numpy as np
+    record_dtype = np.dtype([('code', '<u8'), ('cents', '<i8'), ('quantity', '<u4'),
+                             ('name_offset', '<u4'), ('name_length', '<u2'), ('flags', '<u2')])
+    records = np.frombuffer(data, dtype=record_dtype, count=count, offset=BINARY_HEADER.size)
+    records = records[(records['flags'] & RECORD_DELETED) == 0]
+    strings = data[BINARY_HEADER.size + count * BINARY_RECORD.size:]
+    names = [strings[offset:offset + length].decode('utf-8')
+             for offset, length in zip(records['name_offset'].tolist(), records['name_length'].tolist())]
+    store = ColumnarInventory.from_columns(records['code'], names, records['cents'] / 100, records['quantity'])
+    return store, generation
+
+
+# ---------- SQLite storage ----------
+# Column for each key of an item dict.
+SQLITE_COLUMNS = {'Name': 'name', 'Price': 'price', 'Quantity': 'quantity'}
+# ORDER BY expression for each query() sort key.
+SQLITE_SORT_COLUMNS = {'code': 'code', 'name': 'name COLLATE NOCASE', 'price': 'price', 'quantity': 'quantity'}
+
+
+# inventory stored in an SQLite table.
+# Behaves like the inventory dict: item code -> item with Name, Price, Quantity.
+# Item writes are single-row UPDATEs. They share one transaction until
+# commit(), so a whole purchase lands at once.
+class SQLiteInventory(MutableMapping):
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "code INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+            "price REAL NOT NULL, quantity INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_name ON items (name COLLATE NOCASE)")
+        self.conn.commit()
+
+    def __getitem__(self, code):
+        if code not in self:
+            raise KeyError(code)
+        return SQLiteItem(self.conn, code)
+
+    def __setitem__(self, code, item):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO items (code, name, price, quantity) VALUES (?, ?, ?, ?)",
+            (code, item['Name'], item['Price'], item['Quantity']))
+
+    def __delitem__(self, code):
+        if self.conn.execute("DELETE FROM items WHERE code = ?", (code,)).rowcount == 0:
+            raise KeyError(code)
+
+    def __contains__(self, code):
+        if not isinstance(code, int):
+            return False
+        return self.conn.execute("SELECT 1 FROM items WHERE code = ?", (code,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self.conn.execute("SELECT code FROM items ORDER BY code")])
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def code_for_name(self, name):
+        row = self.conn.execute("SELECT code FROM items WHERE name = ? COLLATE NOCASE", (name,)).fetchone()
+        return row[0] if row else None
+
+    def total_value(self):
+        return self.conn.execute("SELECT COALESCE(SUM(price * quantity), 0) FROM items").fetchone()[0]
+
+    def scale_prices(self, factor):
+        self.conn.execute("UPDATE items SET price = ROUND(price * ?, 2)", (factor,))
+
+    # same as Inventory.query(), answered by SQLite with LIMIT/OFFSET.
+    def query(self, low=None, high=None, prefix=None, sort_by='code', descending=False, offset=0, limit=None):
+        where, params = [], []
+        if low is not None:
+            where.append("code >= ?")
+            params.append(low)
+        if high is not None:
+            where.append("code <= ?")
+            params.append(high)
+        if prefix:
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append(escaped + '%')
+        clause = " WHERE " + " AND ".join(where) if where else ""
+        total = self.conn.execute("SELECT COUNT(*) FROM items" + clause, params).fetchone()[0]
+        column = SQLITE_SORT_COLUMNS[sort_by]
+        direction = "DESC" if descending else "ASC"
+        rows = self.conn.execute(
+            f"SELECT code FROM items{clause} ORDER BY {column} {direction}, code {direction} LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset])
+        return [row[0] for row in rows], total
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+# one row of SQLiteInventory.
+# Reads and writes go straight to the row, so it never goes stale.
+class SQLiteItem(Mapping):
+    def __init__(self, conn, code):
+        self.conn = conn
+        self.code = code
+
+    def __getitem__(self, key):
+        column = SQLITE_COLUMNS[key]
+        row = self.conn.execute(f"SELECT {column} FROM items WHERE code = ?", (self.code,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key, value):
+        column = SQLITE_COLUMNS[key]
+        self.conn.execute(f"UPDATE items SET {column} = ? WHERE code = ?", (value, self.code))
+
+    def __iter__(self):
+        return iter(SQLITE_COLUMNS)
+
+    def __len__(self):
+        return len(SQLITE_COLUMNS)
+
+
+# import the pickle inventory into an SQLite store.
+# Reads the snapshot and replays its journal, then inserts every item
+# in one transaction. Returns the number of items imported.
+def migrate_pickle_to_sqlite(store):
+    inventory_ref, generation = read_snapshot()
+    replay_journal(inventory_ref, generation)
+    for code, item in inventory_ref.items():
+        store[code] = item
+    store.commit()
+    return len(inventory_ref)
+
+
+# owner menu to load, manage, display, see sales or restock needs, or finish.
 # Loops until owner chooses Done.
 def load_items():
+    show_low_stock_alerts()
     while True:
         try:
             choice = int(input(
-                "\nChoose one\n1.Load items into your machine\n2.Manage your machine\n3.Display items in the machine\n4.Done\nEnter your choice: "))
+                "\nChoose one\n1.Load items into your machine\n2.Manage your machine\n3.Display items in the machine\n4.Sales report\n5.Items to restock\n6.Done\nEnter your choice: "))
             if choice == 1:
                 load_item_to_machine()
             elif choice == 2:
                 manage_machine()
             elif choice == 3:
-                display_items(inventory)
-                total_value = sum(item['Price'] * item['Quantity'] for item in inventory.values())
+                browse_items(inventory)
+                total_value = inventory_value_arg(inventory)
                 print(f"\nTotal Inventory Value: ${total_value:.2f}")
 
             elif choice == 4:
+                sales_report()
+
+            elif choice == 5:
+                restock_report()
+
+            elif choice == 6:
                 if not inventory:
                     # If still empty after loading, exit managing as there's nothing to manage
                     print("\nNo items added. Returning to owner menu.\n")
@@ -268,10 +3231,109 @@ def load_items():
                     save_inventory()
                     break
             else:
-                print("\nInvalid input. Please enter (1/2/3/4).")
+                print("\nInvalid input. Please enter (1/2/3/4/5/6).")
 
         except ValueError:
-            print("\nInvalid input. Please enter (1/2/3/4).")
+            print("\nInvalid input. Please enter (1/2/3/4/5/6).")
+
+
+# print and clear the low stock alerts raised since the owner last looked.
+def show_low_stock_alerts():
+    if not low_stock_alerts:
+        return
+    print("\n           ~~~~~~~~~~~~~ Low Stock Alerts ~~~~~~~~~~~~~")
+    for code, quantity in low_stock_alerts:
+        if quantity == 0 and code not in inventory:
+            print(f"Item code {code} sold out and was removed from inventory.")
+        elif quantity == 0:
+            print(f"Item code {code} is out of stock.")
+        else:
+            print(f"Item code {code} is down to {quantity} unit(s).")
+    low_stock_alerts.clear()
+
+
+# print items at or below the low stock threshold, lowest first.
+# Reads only the low end of the low stock heap. Then shows the forecast
+# restock plan from recent sales and offers to apply it in one step.
+def restock_report():
+    queue = low_stock if low_stock is not None else open_low_stock()
+    low = queue.lowest(PAGE_SIZE, only_low=True)
+    if not low:
+        print(f"\n   ~~~~ Every item has more than {queue.threshold} units. ~~~~")
+    else:
+        print("\n           ~~~~~~~~~~~~~ Items To Restock ~~~~~~~~~~~~~")
+        table_data = [[code, inventory[code]['Name'], quantity] for code, quantity, _ in low]
+        headers = ['Item Code', 'Item Name', 'Quantity(units)']
+        print(render_table(table_data, headers))
+
+    if sales_rollups is None or not sales_rollups.sales:
+        return
+    plan = restock_plan_arg(inventory, sales_rollups)
+    if not plan:
+        print(f"\n   ~~~~ No item is expected to sell out in the next {RESTOCK_HORIZON_DAYS} days. ~~~~")
+        return
+    print("\n           ~~~~~~~~~~~~~ Recommended Restock ~~~~~~~~~~~~~")
+    table_data = [[code, inventory[code]['Name'], quantity, new_quantity, round(hours_left / 24, 1)]
+                  for code, quantity, new_quantity, hours_left in plan[:PAGE_SIZE]]
+    headers = ['Item Code', 'Item Name', 'Quantity(units)', 'Restock To(units)', 'Days Left']
+    print(render_table(table_data, headers))
+    if len(plan) > PAGE_SIZE:
+        print(f"...and {len(plan) - PAGE_SIZE} more item(s).")
+
+    while True:
+        apply = input(f"Restock all {len(plan)} item(s) as recommended? (y/n): ").strip().lower()
+        if apply in ['y', 'yes']:
+            if not record_changes(apply_restock_plan_arg(inventory, plan)):
+                request_sync()
+            print(f"\n{len(plan)} item(s) restocked.")
+            return
+        elif apply in ['n', 'no']:
+            print("\nNo items restocked.")
+            return
+        else:
+            print("\nInvalid input. Please enter 'y' or 'n'.\n")
+
+
+# print revenue from the sales rollups and the tracked best sellers.
+# Reads only running totals, so it is instant however many sales exist.
+# Tracker counts may be too high by their possible overcount, so a count
+# with one is shown as a range; an item missing from the revenue tracker
+# has no revenue figure.
+def sales_report():
+    rollups = sales_rollups or SalesRollups()
+    if not rollups.sales:
+        print("\n   ~~~~ No sales recorded yet. ~~~~")
+        return
+    print("\n           ~~~~~~~~~~~~~ Sales Report ~~~~~~~~~~~~~")
+    print(f"Revenue today: ${rollups.revenue_on():.2f}")
+    print(f"Revenue in the last 24 hours: ${rollups.revenue_last_hours(24):.2f}")
+    print(f"All time: {rollups.sales} sales, ${rollups.cents / 100:.2f}\n")
+
+    table_data = []
+    if best_sellers is not None:
+        revenue = best_sellers.revenue.counts
+        top = []
+        for code, units, error in best_sellers.top(5):
+            cents, cents_error = revenue.get(code, (None, 0))
+            top.append((code, tracked_range(units, error),
+                        '-' if cents is None else tracked_range(cents / 100, cents_error / 100)))
+    else:
+        top = rollups.top_sellers(5)
+    for code, units, revenue in top:
+        name = inventory[code]['Name'] if code in inventory else "(no longer stocked)"
+        table_data.append([code, name, units, revenue])
+    headers = ['Item Code', 'Item Name', 'Units Sold', 'Revenue(in $)']
+    print(render_table(table_data, headers))
+
+
+# a tracked count, or the range it lies in when it may be too high.
+# Inputs: count and its possible overcount.
+def tracked_range(count, error):
+    if not error:
+        return count
+    if isinstance(count, float):
+        return f"{count - error:.2f}-{count:.2f}"
+    return f"{count - error}-{count}"
 
 
 # add new item(s) to machine.
@@ -300,6 +3362,8 @@ def load_item_to_machine():
                     if add_more in ['y', 'yes']:
                         quantity_to_add = input_positive_integer("Enter quantity to add: ")
                         inventory[item_code]['Quantity'] += quantity_to_add
+                        record_stock(item_code, inventory[item_code]['Quantity'])
+                        record_change(('quantity', item_code, inventory[item_code]['Quantity']))
                         print(f"\nQuantity updated. New quantity: {inventory[item_code]['Quantity']}")
                         break
                     elif add_more in ['n', 'no']:
@@ -320,7 +3384,7 @@ def load_item_to_machine():
                     continue
 
                 # Check for duplicate names in inventory (case-insensitive)
-                if any(item['Name'].lower() == name.lower() for item in inventory.values()):
+                if find_item_by_name_arg(inventory, name) is not None:
                     print(f"\nAn item with the name '{name}' already exists in the inventory. Please use a different name.\n")
                     continue
 
@@ -341,7 +3405,9 @@ def load_item_to_machine():
 
             quantity = input_positive_integer("Enter Quantity of Item: ")
 
-            inventory[item_code] = {"Name": name, "Price": price, "Quantity": quantity}
+            inventory[item_code] = Item(name, price, quantity)
+            record_stock(item_code, quantity)
+            record_change(('add', item_code, name, price, quantity))
             print(f"\n{quantity} {name}(s) added successfully into your Vending Machine.")
 
         elif choice == 2:
@@ -365,10 +3431,10 @@ def manage_machine():
             return
 
     while True:
-        display_items(inventory)
+        display_items(inventory, inventory_view)
         try:
             manage_choice = int(input(
-                "\nManage your machine\n1.Adjust quantity of item\n2.Remove item\n3.Adjust the price of the item\n4.Done\nEnter your choice: "))
+                "\nManage your machine\n1.Adjust quantity of item\n2.Remove item\n3.Adjust the price of the item\n4.Adjust all prices by percent\n5.Done\nEnter your choice: "))
 
             if manage_choice == 1:
                 if not inventory:
@@ -392,13 +3458,16 @@ def manage_machine():
                 adjust_item_price()
 
             elif manage_choice == 4:
+                adjust_all_prices()
+
+            elif manage_choice == 5:
                 break
 
             else:
-                print("\nInvalid input. Please enter (1/2/3/4).")
+                print("\nInvalid input. Please enter (1/2/3/4/5).")
 
         except ValueError:
-            print("\nInvalid input. Please enter (1/2/3/4).")
+            print("\nInvalid input. Please enter (1/2/3/4/5).")
 
 
 # adjust quantity for an item.
@@ -414,7 +3483,8 @@ def adjust_quantity():
                 if new_quantity < 0:
                     print("\nQuantity must be a positive integer. Please try again.\n")
                 else:
-                    inventory[item_code]['Quantity'] = new_quantity
+                    adjust_quantity_arg(inventory, item_code, new_quantity)
+                    record_change(('quantity', item_code, new_quantity))
                     print(f"\nQuantity of {inventory[item_code]['Name']} adjusted to {new_quantity}.")
                     return
         else:
@@ -427,11 +3497,13 @@ def adjust_quantity():
 def remove_items(inventory_ref):
     while True:
         print("\nCurrent Inventory Items:")
-        display_items(inventory_ref)
+        display_items(inventory_ref, inventory_view)
         remove_item_code = input_positive_integer("Enter Item Code to remove: ")
         if remove_item_code in inventory_ref:
             removed_item_name = inventory_ref[remove_item_code]['Name']
             del inventory_ref[remove_item_code]
+            record_stock(remove_item_code, None)
+            record_change(('remove', remove_item_code))
             print(f"\nItem {removed_item_name} with code {remove_item_code} removed from inventory.")
             return
         else:
@@ -454,6 +3526,7 @@ def adjust_item_price():
                         print("\nPrice cannot be negative. Please try again.\n")
                     else:
                         inventory[item_code]['Price'] = new_price
+                        record_change(('price', item_code, new_price))
                         print(f"\nPrice of {inventory[item_code]['Name']} adjusted to ${new_price:.2f}.")
                         return
                 except ValueError:
@@ -463,10 +3536,30 @@ def adjust_item_price():
 
 
 
+# adjust every price by a percentage.
+# Prompts for the percent, e.g. 10 or -5.
+# Validates it and updates inventory.
+def adjust_all_prices():
+    global inventory
+    while True:
+        percent_input = input("Enter percent change for all prices (e.g. 10 or -5): ").strip()
+        try:
+            percent = float(percent_input)
+            adjust_all_prices_arg(inventory, percent)
+        except ValueError:
+            print("\nPercent must be a number above -100. Please try again.\n")
+            continue
+        record_change(('scale_prices', percent))
+        print(f"\nAll prices adjusted by {percent:g}%.")
+        return
+
+
 # display inventory table.
 # If empty, prompts to add items.
-# Uses tabulate to print a fancy_grid table.
-def display_items(inventory_ref):
+# With a view (see inventory_view) only that page is queried and shown;
+# without one every item is shown.
+# Prints through inventory_table, which caches formatted rows.
+def display_items(inventory_ref, view=None):
     if not inventory_ref:
         print("\n   ~~~~ Your vending machine is empty. Please add items first. ~~~~   ")
         load_item_to_machine()
@@ -476,18 +3569,81 @@ def display_items(inventory_ref):
             return
 
     print("\n           ~~~~~~~~~~~~~ Available Items ~~~~~~~~~~~~~")
-    table_data = []
-    for code, item_data in inventory_ref.items():
-        row = [
-            code,
-            item_data['Name'],
-            item_data['Price'],
-            item_data['Quantity']
-        ]
-        table_data.append(row)
+    if view is not None:
+        table_data, total = query_items_arg(inventory_ref, **view)
+        pages = max(1, -(-total // view['page_size']))
+        if view['page'] > pages:
+            view['page'] = pages
+            table_data, total = query_items_arg(inventory_ref, **view)
+        if not table_data:
+            print("\n   ~~~~ No items match the current filters. ~~~~")
+            return
+    elif hasattr(inventory_ref, 'rows'):
+        table_data = inventory_ref.rows()
+    else:
+        table_data = []
+        for code, item_data in inventory_ref.items():
+            row = [
+                code,
+                item_data['Name'],
+                item_data['Price'],
+                item_data['Quantity']
+            ]
+            table_data.append(row)
 
-    headers = ['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)']
-    print(tabulate(table_data, headers=headers, tablefmt='fancy_grid'))
+    # Only rows whose values changed since the last display are re-formatted
+    inventory_table.sync((row[0], row) for row in table_data)
+    print(inventory_table.render(row[0] for row in table_data))
+    if view is not None:
+        print(f"Page {view['page']} of {pages} ({total} items)")
+
+
+# page through the owner's inventory view.
+# Lets owner change page, filter by code range or name prefix, and sort.
+def browse_items(inventory_ref):
+    while True:
+        display_items(inventory_ref, inventory_view)
+        if not inventory_ref:
+            return
+        try:
+            choice = int(input(
+                "\nBrowse items\n1.Next page\n2.Previous page\n3.Filter by item code range\n4.Filter by name prefix\n5.Sort items\n6.Clear filters\n7.Done\nEnter your choice: "))
+        except ValueError:
+            print("\nInvalid input. Please enter (1/2/3/4/5/6/7).")
+            continue
+
+        if choice == 1:
+            inventory_view['page'] += 1
+        elif choice == 2:
+            inventory_view['page'] = max(1, inventory_view['page'] - 1)
+        elif choice == 3:
+            low = input("Enter lowest item code (blank for none): ").strip()
+            high = input("Enter highest item code (blank for none): ").strip()
+            try:
+                low = input_positive_integer_arg(low) if low else None
+                high = input_positive_integer_arg(high) if high else None
+                if low is not None and high is not None and low > high:
+                    raise ValueError("Lowest code is above highest code")
+            except ValueError:
+                print("\nItem codes must be positive integers, lowest first. Filter unchanged.")
+                continue
+            inventory_view.update(low=low, high=high, page=1)
+        elif choice == 4:
+            prefix = input("Enter the start of the item name (blank for none): ").strip()
+            inventory_view.update(prefix=prefix or None, page=1)
+        elif choice == 5:
+            sort_choice = input("\nSort by\n1.Item code\n2.Item name\n3.Price\n4.Quantity\nEnter your choice: ").strip()
+            if sort_choice not in ('1', '2', '3', '4'):
+                print("\nInvalid input. Please enter (1/2/3/4).")
+                continue
+            descending = input("Descending order? (y/n): ").strip().lower() == 'y'
+            inventory_view.update(sort_by=SORT_KEYS[int(sort_choice) - 1], descending=descending, page=1)
+        elif choice == 6:
+            inventory_view.update(low=None, high=None, prefix=None, sort_by='code', descending=False, page=1)
+        elif choice == 7:
+            return
+        else:
+            print("\nInvalid input. Please enter (1/2/3/4/5/6/7).")
 
 
 # user purchase menu.
@@ -580,11 +3736,7 @@ def add_to_cart(user_cart, inventory_ref):
         if user_item_code in user_cart:
             user_cart[user_item_code]['Quantity'] += quantity
         else:
-            user_cart[user_item_code] = {
-                "Name": item_name,
-                "Price": inventory_ref[user_item_code]['Price'],
-                "Quantity": quantity
-            }
+            user_cart[user_item_code] = CartLine(inventory_ref[user_item_code], quantity)
         print(f"\n{quantity} {item_name}(s) added to cart.")
         break
 
@@ -608,7 +3760,7 @@ def view_cart(user_cart):
             table_data.append(row)
             total_price += item_data['Price'] * item_data['Quantity']
         headers = ['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)']
-        print(tabulate(table_data, headers=headers, tablefmt='fancy_grid'))
+        print(render_table(table_data, headers))
         print(f"\nTotal Price: ${total_price:.2f}\n")
 
 
@@ -630,7 +3782,7 @@ def manage_cart(user_cart, inventory_ref):
         ]
         table_data.append(row)
     headers = ['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)']
-    print(tabulate(table_data, headers=headers, tablefmt='fancy_grid'))
+    print(render_table(table_data, headers))
     while True:
         manage_item_code = input_positive_integer("Enter Item Code to manage: ")
         if manage_item_code not in user_cart:
@@ -664,6 +3816,7 @@ def manage_cart(user_cart, inventory_ref):
 # confirm purchase with IO.
 # Shows bill preview and asks for confirmation.
 # Updates inventory, prints messages, saves inventory, and clears cart on success.
+# In journal or SQLite mode only the sold quantities are persisted.
 def confirm_purchase(user_cart, inventory_ref):
     if not user_cart:
         print("\n   ----- Your cart is empty. Please add items to purchase. -----")
@@ -686,23 +3839,27 @@ def confirm_purchase(user_cart, inventory_ref):
         table_data.append(row)
 
     headers = ['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)', 'Each Item Total(in $)']
-    print(tabulate(table_data, headers=headers, tablefmt='fancy_grid'))
+    print(render_table(table_data, headers))
     print(f"\nTotal Price: ${total_price:.2f}\n")
 
     while True:
         confirm = input("Confirm purchase? (y/n): ").strip().lower()
         if confirm in ["y", "yes"]:
-            transaction_id = str(uuid.uuid4())[:8]
-
-            for code, item_data in dict(user_cart).items():
-                inventory_ref[code]['Quantity'] -= item_data['Quantity']
-                if inventory_ref[code]['Quantity'] == 0:
+            record = purchase_record(user_cart)
+            bill = dict(user_cart)
+            try:
+                transaction_id = confirm_purchase_arg(user_cart, inventory_ref)
+            except (KeyError, ValueError) as e:
+                print(f"\n   ~~~~ Purchase failed: {e.args[0]} ~~~~")
+                return False
+
+            for code, item_data in bill.items():
+                if code not in inventory_ref:
                     print(f"{item_data['Name']} is now out of stock and removed from inventory.\n")
-                    del inventory_ref[code]
             print("\n   ~~~~ Purchase successful ~~~~")
-            generate_bill(user_cart, total_price, transaction_id)
-            user_cart.clear()
-            save_inventory()
+            generate_bill(bill, total_price, transaction_id)
+            if not record_change(record):
+                request_sync()
             return True
         elif confirm in ["n", "no"]:
             print("\n   ~~~~ Purchase cancelled ~~~~")
@@ -736,12 +3893,14 @@ def generate_bill(user_cart, total_price, transaction_id=None):
         table_data.append(row)
 
     headers = ['Item Code', 'Item Name', '1 Item Cost(in $)', 'Quantity(units)', 'Total(in $)']
-    print(tabulate(table_data, headers=headers, tablefmt='fancy_grid'))
+    print(render_table(table_data, headers))
     print(f"\nTotal Price: ${total_price:.2f}\n")
 
-    f = Figlet(font='standard')
-    print(f.renderText("Thank You\nVisit Us Again"))
+    print(render_banner("Thank You\nVisit Us Again"))
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["serve"]:
+        run_service()
+    else:
+        main()
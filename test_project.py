@@ -1,13 +1,58 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
 import pytest
+import project
 from project import (
     input_positive_integer_arg,
     add_to_cart_arg,
     adjust_quantity_arg,
     adjust_item_price_arg,
     manage_cart_arg,
-    confirm_purchase_arg
+    confirm_purchase_arg,
+    append_journal,
+    purchase_record,
+    SQLiteInventory,
+    pack_binary_inventory,
+    unpack_binary_inventory,
+    MappedInventory,
+    Item,
+    CartLine,
+    ColumnarInventory,
+    adjust_all_prices_arg,
+    inventory_value_arg,
+    Inventory,
+    find_item_by_name_arg,
+    confirm_purchases_batch_arg,
+    ConcurrentInventory,
+    confirm_purchase_optimistic_arg,
+    ReservationBook,
+    VendingService,
+    FleetRouter,
+    shard_for,
+    query_items_arg,
+    SalesLedger,
+    SalesRollups,
+    HeavyHitters,
+    BestSellers,
+    LowStockQueue,
+    forecast_restock,
+    restock_plan_arg,
+    apply_restock_plan_arg
 )
 
+# Wall-clock checks are flaky on shared machines, so they only run when
+# VENDING_BENCHMARKS is set; the other tests check behaviour and counts.
+BENCHMARKS = bool(os.environ.get("VENDING_BENCHMARKS"))
+benchmark = pytest.mark.skipif(not BENCHMARKS, reason="set VENDING_BENCHMARKS=1 to run timing benchmarks")
+
 def test_input_positive_integer_arg():
     assert input_positive_integer_arg("1") == 1
     assert input_positive_integer_arg("42") == 42
@@ -158,3 +203,1445 @@ def test_confirm_purchase_arg():
     cart_too_much = {4: {"Name": "Chips", "Price": 1.0, "Quantity": 2}}
     with pytest.raises(ValueError):
         confirm_purchase_arg(cart_too_much, inventory)
+
+
+def test_journal_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10},
+        2: {"Name": "Soda", "Price": 1.5, "Quantity": 5}
+    })
+    project.save_inventory()
+
+    # Changes after the snapshot only go to the journal
+    append_journal([
+        purchase_record({1: {"Name": "Water", "Price": 1.0, "Quantity": 3}}),
+        ('price', 2, 2.0),
+        ('add', 3, "Chips", 1.25, 4),
+        purchase_record({2: {"Name": "Soda", "Price": 2.0, "Quantity": 5}}),
+        ('quantity', 3, 6),
+    ])
+    project.inventory = {}
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 7
+    assert 2 not in project.inventory  # Sold out and removed
+    assert project.inventory[3] == {"Name": "Chips", "Price": 1.25, "Quantity": 6}
+
+    # A new snapshot folds the journal; replaying again must not double count
+    project.save_inventory()
+    project.inventory = {}
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 7
+
+    # A torn record at the end of the journal is ignored
+    with open(project.JOURNAL_FILE, "ab") as f:
+        f.write(b"\x80torn")
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 7
+
+
+def test_journal_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "JOURNAL_MAX_RECORDS", 3)
+    monkeypatch.setattr(project, "inventory", {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10}
+    })
+    project.save_inventory()
+
+    append_journal([('price', 1, 1.25), ('quantity', 1, 20)])
+    assert project.compactor_thread is None or not project.compactor_thread.is_alive()
+    append_journal([purchase_record({1: {"Name": "Water", "Price": 1.25, "Quantity": 4}})])
+    project.compactor_thread.join()
+
+    # Journal folded into the snapshot and truncated to its header
+    assert project.journal_records == 0
+    assert list(project.read_journal()) == [('generation', project.journal_generation)]
+    snapshot, generation = project.read_snapshot()
+    assert generation == project.journal_generation
+    assert snapshot[1] == {"Name": "Water", "Price": 1.25, "Quantity": 16}
+
+    project.inventory = {}
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 16
+
+
+def test_sqlite_inventory(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "SQLITE_FILE", str(tmp_path / "inventory.db"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10},
+        2: {"Name": "Soda", "Price": 1.5, "Quantity": 5}
+    })
+    project.save_inventory()
+    append_journal([('price', 2, 2.0)])
+
+    # First sqlite start imports the pickle snapshot and its journal
+    monkeypatch.setattr(project, "STORAGE_BACKEND", "sqlite")
+    project.load_inventory()
+    store = project.inventory
+    assert isinstance(store, SQLiteInventory)
+    assert dict(store[2]) == {"Name": "Soda", "Price": 2.0, "Quantity": 5}
+
+    cart = {}
+    add_to_cart_arg(cart, store, 1, 3)
+    add_to_cart_arg(cart, store, 2, 5)
+    assert confirm_purchase_arg(cart, store)
+    assert store[1]["Quantity"] == 7
+    assert 2 not in store
+
+    # Uncommitted changes roll back; committed ones persist
+    store.rollback()
+    assert store[2]["Quantity"] == 5
+    adjust_quantity_arg(store, 1, 4)
+    adjust_item_price_arg(store, 1, 1.25)
+    project.save_inventory()
+    store.close()
+
+    reopened = SQLiteInventory(project.SQLITE_FILE)
+    assert dict(reopened[1]) == {"Name": "Water", "Price": 1.25, "Quantity": 4}
+    assert len(reopened) == 2
+    with pytest.raises(KeyError):
+        adjust_quantity_arg(reopened, 3, 1)
+    reopened.close()
+
+
+def test_atomic_save_and_group_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10}
+    })
+    project.save_inventory()
+
+    # A failing save leaves the old snapshot and no temp file behind
+    project.inventory[2] = {"Name": "Soda", "Price": 1.5, "Quantity": lambda: 5}
+    with pytest.raises(Exception):
+        project.save_inventory()
+    del project.inventory[2]
+    assert project.read_snapshot()[0] == {1: {"Name": "Water", "Price": 1.0, "Quantity": 10}}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["inventory.journal", "inventory.pkl"]
+
+    # When the temp file can't even be created, that error is the one raised
+    with pytest.raises(FileNotFoundError) as error:
+        project.atomic_write(str(tmp_path / "missing" / "inventory.pkl"), lambda f: None)
+    assert error.value.__context__ is None
+
+    # Sales inside one commit window share a single fsync
+    fsyncs = []
+    real_fsync = project.os.fsync
+    monkeypatch.setattr(project.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    monkeypatch.setattr(project, "GROUP_COMMIT_WINDOW", 60)
+    for _ in range(5):
+        project.record_change(purchase_record({1: {"Name": "Water", "Price": 1.0, "Quantity": 1}}))
+    assert fsyncs == []
+    project.sync_now()
+    assert len(fsyncs) == 1
+    assert project.sync_timer is None
+
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 5
+
+    # Snapshot mode: reloading inside the window writes the pending sale first
+    monkeypatch.setattr(project, "JOURNAL_MODE", False)
+    project.inventory[1]["Quantity"] = 2
+    assert not project.record_change(("quantity", 1, 2))
+    project.request_sync()
+    assert project.sync_timer is not None
+    project.load_inventory()
+    assert project.sync_timer is None
+    assert project.inventory[1]["Quantity"] == 2
+    assert project.read_snapshot()[0][1]["Quantity"] == 2
+
+
+def test_binary_inventory(tmp_path, monkeypatch):
+    inventory = {
+        7: {"Name": "Crème Brûlée", "Price": 3.75, "Quantity": 2},
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10}
+    }
+    data = pack_binary_inventory(inventory, 4)
+    assert unpack_binary_inventory(data) == (inventory, 4)
+    assert list(unpack_binary_inventory(data)[0]) == [1, 7]  # Sorted by code
+
+    with pytest.raises(ValueError):
+        unpack_binary_inventory(b"XXXX" + data[4:])
+    with pytest.raises(ValueError):
+        pack_binary_inventory({1: {"Name": "Water", "Price": 1.0, "Quantity": -1}})
+
+    # Binary backend converts the pickle once and keeps its journal
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "BINARY_FILE", str(tmp_path / "inventory.bin"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", dict(inventory))
+    project.save_inventory()
+    append_journal([('quantity', 1, 12)])
+
+    monkeypatch.setattr(project, "STORAGE_BACKEND", "binary")
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 12
+    project.save_inventory()
+    project.inventory = {}
+    project.load_inventory()
+    assert project.inventory[1]["Quantity"] == 12
+    assert project.inventory[7]["Name"] == "Crème Brûlée"
+
+
+def test_mapped_inventory(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "BINARY_FILE", str(tmp_path / "inventory.bin"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 10},
+        2: {"Name": "Soda", "Price": 1.5, "Quantity": 5},
+        3: {"Name": "Chips", "Price": 2.0, "Quantity": 4}
+    })
+    project.save_inventory()
+    append_journal([('quantity', 3, 6)])
+
+    # First mmap start converts the pickle and folds in its journal once
+    monkeypatch.setattr(project, "STORAGE_BACKEND", "mmap")
+    project.load_inventory()
+    store = project.inventory
+    assert isinstance(store, MappedInventory)
+    assert store[3]["Quantity"] == 6
+
+    cart = {}
+    add_to_cart_arg(cart, store, 1, 3)
+    add_to_cart_arg(cart, store, 2, 5)
+    confirm_purchase_arg(cart, store)
+    adjust_item_price_arg(store, 3, 2.25)
+    store.commit()
+    assert len(store) == 2
+    assert list(store) == [1, 3]
+
+    # Adding a new code rewrites the file; tombstones are dropped
+    store[4] = {"Name": "Juice", "Price": 2.5, "Quantity": 1}
+    store.close()
+
+    reopened = MappedInventory(project.BINARY_FILE)
+    assert {code: dict(item) for code, item in reopened.items()} == {
+        1: {"Name": "Water", "Price": 1.0, "Quantity": 7},
+        3: {"Name": "Chips", "Price": 2.25, "Quantity": 6},
+        4: {"Name": "Juice", "Price": 2.5, "Quantity": 1}
+    }
+    assert 2 not in reopened
+    with pytest.raises(ValueError):
+        adjust_quantity_arg(reopened, 1, 2 ** 32)
+    reopened.close()
+
+
+def test_item_records():
+    water = Item("Water", 1.0, 10)
+    assert water["Name"] == "Water"
+    assert water.get("Quantity") == 10
+    assert water.get("Colour", 0) == 0
+    assert water == {"Name": "Water", "Price": 1.0, "Quantity": 10}
+    assert not hasattr(water, "__dict__")
+    with pytest.raises(KeyError):
+        water["Name"] = "Soda"
+
+    # Cart lines reference the inventory item instead of copying it
+    inventory = {1: water}
+    cart = {}
+    add_to_cart_arg(cart, inventory, 1, 3)
+    assert isinstance(cart[1], CartLine)
+    assert cart[1].item is water
+    assert cart[1] == {"Name": "Water", "Price": 1.0, "Quantity": 3}
+    adjust_item_price_arg(inventory, 1, 1.25)
+    assert cart[1]["Price"] == 1.25
+    with pytest.raises(KeyError):
+        cart[1]["Price"] = 0.5
+
+    confirm_purchase_arg(cart, inventory)
+    assert water["Quantity"] == 7
+
+
+def test_columnar_inventory(tmp_path, monkeypatch):
+    inventory = {
+        1: Item("Water", 1.0, 10),
+        2: Item("Soda", 1.5, 5),
+        3: Item("Chips", 2.0, 4)
+    }
+    store = ColumnarInventory.from_mapping(inventory)
+    assert inventory_value_arg(store) == inventory_value_arg(inventory) == 25.5
+
+    cart = {}
+    add_to_cart_arg(cart, store, 2, 5)
+    add_to_cart_arg(cart, store, 1, 4)
+    confirm_purchase_arg(cart, store)
+    assert 2 not in store  # Last row moved into the sold out slot
+    assert store.rows() == [[1, "Water", 1.0, 6], [3, "Chips", 2.0, 4]]
+    assert inventory_value_arg(store) == 14.0
+
+    adjust_all_prices_arg(store, 10)
+    assert store[1]["Price"] == 1.1
+    assert store[3]["Price"] == 2.2
+    with pytest.raises(ValueError):
+        adjust_all_prices_arg(store, -100)
+
+    for code in range(10, 100):
+        store[code] = Item(f"Item {code}", 0.5, code)
+    assert len(store) == 92
+    assert store[99]["Quantity"] == 99
+
+    # Binary snapshots load straight into columns
+    monkeypatch.setattr(project, "BINARY_FILE", str(tmp_path / "inventory.bin"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "STORAGE_BACKEND", "binary")
+    monkeypatch.setattr(project, "INVENTORY_LAYOUT", "columnar")
+    monkeypatch.setattr(project, "inventory", inventory)
+    project.save_inventory()
+    project.load_inventory()
+    assert isinstance(project.inventory, ColumnarInventory)
+    assert {code: dict(item) for code, item in project.inventory.items()} == inventory
+
+
+def test_name_index(tmp_path):
+    inventory = Inventory({
+        1: Item("Water", 1.0, 10),
+        2: Item("Soda", 1.5, 5)
+    })
+    assert find_item_by_name_arg(inventory, "WATER") == 1
+    assert find_item_by_name_arg(inventory, "juice") is None
+
+    # Sell out removes the name
+    cart = {}
+    add_to_cart_arg(cart, inventory, 2, 5)
+    confirm_purchase_arg(cart, inventory)
+    assert find_item_by_name_arg(inventory, "soda") is None
+
+    # Owner add, replace and remove
+    inventory[3] = Item("Chips", 2.0, 4)
+    inventory[3] = Item("Nachos", 2.0, 4)
+    assert find_item_by_name_arg(inventory, "chips") is None
+    assert find_item_by_name_arg(inventory, "nachos") == 3
+    inventory.pop(3)
+    del inventory[1]
+    assert inventory.name_index == {}
+
+    # Plain dicts and the other stores answer the same way
+    plain = {1: Item("Water", 1.0, 10)}
+    assert find_item_by_name_arg(plain, "water") == 1
+    store = ColumnarInventory.from_mapping({1: Item("Water", 1.0, 10), 2: Item("Soda", 1.5, 5)})
+    del store[1]
+    assert find_item_by_name_arg(store, "SODA") == 2
+    assert find_item_by_name_arg(store, "water") is None
+    db = SQLiteInventory(str(tmp_path / "inventory.db"))
+    db[7] = Item("Water", 1.0, 10)
+    assert find_item_by_name_arg(db, "wAtEr") == 7
+    db.close()
+
+
+# dict that fails on any whole-inventory pass, to show an operation only
+# touches the items it names.
+class NoScanDict(dict):
+    def scan(self, *args):
+        raise AssertionError("the whole inventory was scanned")
+
+    __iter__ = keys = values = items = __len__ = copy = scan
+
+
+def test_confirm_purchase_arg_scales_with_cart():
+    # Checkout work must not grow with the inventory size: it looks up the
+    # cart's items and never walks the inventory
+    inventory = NoScanDict.fromkeys(range(2, 1001), Item("Filler", 1.0, 5))
+    inventory[1] = Item("Water", 1.0, 10)
+    inventory[2] = Item("Soda", 1.5, 1)
+    cart = {1: CartLine(inventory[1], 3), 2: CartLine(inventory[2], 1)}
+    confirm_purchase_arg(cart, inventory)
+    assert cart == {} and dict.__getitem__(inventory, 1)["Quantity"] == 7
+    assert 2 not in inventory
+
+
+def test_confirm_purchases_batch_arg():
+    inventory = {
+        1: Item("Water", 1.0, 10),
+        2: Item("Soda", 1.5, 5)
+    }
+    carts = [
+        {1: CartLine(inventory[1], 4), 2: CartLine(inventory[2], 3)},
+        {2: CartLine(inventory[2], 3)},  # Only 2 Soda left after the first cart
+        {},
+        {3: CartLine(Item("Juice", 2.0, 1), 1)},
+        {1: CartLine(inventory[1], 6), 2: CartLine(inventory[2], 2)},
+    ]
+    results = confirm_purchases_batch_arg(carts, inventory)
+
+    assert [status for status, _ in results] == ['accepted', 'rejected', 'rejected', 'rejected', 'accepted']
+    assert len(results[0][1]) == 8
+    assert results[1][1] == "Not enough item Soda in inventory"
+    assert results[2][1] == "Cart is empty"
+    assert results[3][1] == "Item code 3 not found in inventory"
+    assert inventory == {}  # Both items sold out
+    assert carts[0] == {} and carts[4] == {}  # Accepted carts cleared
+    assert carts[1][2]["Quantity"] == 3  # Rejected carts kept
+
+
+def test_checkout_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", Inventory({1: Item("Water", 1.0, 10)}))
+    project.save_inventory()
+
+    carts = [{1: CartLine(project.inventory[1], 1)} for _ in range(12)]
+    results = project.checkout_batch(carts)
+    assert [status for status, _ in results].count('accepted') == 10
+    assert len(list(project.read_journal())) == 11  # Header plus accepted carts
+
+    project.load_inventory()
+    assert project.inventory == {}
+
+
+def test_concurrent_inventory_stress(monkeypatch):
+    stock = {code: 1000 + 20 * code for code in range(1, 41)}
+    shared = ConcurrentInventory(Inventory(
+        (code, Item(f"Item {code}", 1.0, quantity)) for code, quantity in stock.items()))
+    # The low stock queue and sales trackers hear from every stripe at once
+    queue = LowStockQueue(threshold=50)
+    queue.load(shared.data)
+    rollups = SalesRollups()
+    sellers = BestSellers(capacity=8)
+    monkeypatch.setattr(project, "stock_listeners", [queue.update])
+    monkeypatch.setattr(project, "sale_listeners", [rollups.add, sellers.add])
+    sold = {code: 0 for code in stock}
+    sold_lock = threading.Lock()
+    lowest = []
+
+    def customer(seed):
+        rng = random.Random(seed)
+        for _ in range(300):
+            cart = {}
+            for code in rng.sample(sorted(stock), 2):
+                try:
+                    shared.add_to_cart(cart, code, rng.randint(1, 12))
+                except (KeyError, ValueError):
+                    pass
+            if not cart:
+                continue
+            bought = {code: item["Quantity"] for code, item in cart.items()}
+            try:
+                shared.checkout(cart)
+            except (KeyError, ValueError):
+                continue
+            with sold_lock:
+                for code, quantity in bought.items():
+                    sold[code] += quantity
+            lowest.append(min((item["Quantity"] for item in list(shared.data.values())), default=0))
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=customer, args=(seed,)) for seed in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert min(lowest) >= 0
+    for code, quantity in stock.items():
+        left = shared[code]["Quantity"] if code in shared else 0
+        assert left >= 0
+        assert sold[code] + left == quantity  # Never oversold
+
+    assert all(queue.heap[(index - 1) // 2] <= entry for index, entry in enumerate(queue.heap) if index)
+    assert all(queue.heap[index][1] == code for code, index in queue.position.items())
+    assert queue.quantities == {code: item["Quantity"] for code, item in shared.data.items()}
+    assert {code: units for code, (units, _) in rollups.totals.items()} == {code: n for code, n in sold.items() if n}
+    assert sellers.units.total == sum(sold.values())
+
+    # Listener calls from many threads at once, with random stock levels
+    def report(seed):
+        rng = random.Random(seed)
+        for _ in range(2000):
+            code = rng.randint(1, 40)
+            project.record_stock(code, rng.randint(0, 100))
+            project.record_sale("t", ((code, 1, 1.0),))
+
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=report, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert all(queue.heap[(index - 1) // 2] <= entry for index, entry in enumerate(queue.heap) if index)
+    assert all(queue.heap[index][1] == code for code, index in queue.position.items())
+    assert sellers.units.total == sum(units for units, _ in rollups.totals.values()) == sum(sold.values()) + 8 * 2000
+
+    # Sell-outs under different stripes keep the sorted query indexes intact
+    items = Inventory((code, Item(f"Item {code:04d}", 1.0, 1)) for code in range(1, 2001))
+    shared = ConcurrentInventory(items)
+    items.query(limit=1)
+    errors = []
+
+    def sell_out(codes):
+        try:
+            for code in codes:
+                shared.checkout({code: CartLine(items[code], 1)})
+                if code % 3 == 0:
+                    items.query(prefix="Item 1", limit=5)
+        except Exception as e:
+            errors.append(e)
+
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=sell_out, args=(range(start, 1901, 8),)) for start in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert len(items) == 100
+    assert items.code_order == sorted(items)
+    assert items.name_order == sorted((item["Name"].casefold(), code) for code, item in items.items())
+
+
+def test_confirm_purchase_optimistic_arg(monkeypatch):
+    inventory = Inventory({1: Item("Water", 1.0, 10), 2: Item("Soda", 1.5, 5)})
+    assert inventory[1].version == 0
+    adjust_item_price_arg(inventory, 1, 1.25)
+    assert inventory[1].version == 1
+
+    # Another checkout sneaks in after validation: the cart is retried
+    validations = []
+    real_validate = project.validate_cart_arg
+
+    def racing_validate(user_cart, inventory_ref):
+        real_validate(user_cart, inventory_ref)
+        validations.append(1)
+        if len(validations) == 1:
+            project.commit_cart_arg({1: CartLine(inventory_ref[1], 2)}, inventory_ref)
+
+    monkeypatch.setattr(project, "validate_cart_arg", racing_validate)
+    cart = {1: CartLine(inventory[1], 3), 2: CartLine(inventory[2], 5)}
+    assert len(confirm_purchase_optimistic_arg(cart, inventory)) == 8
+    assert len(validations) == 2
+    assert inventory[1]["Quantity"] == 5  # 10 - 2 - 3
+    assert 2 not in inventory
+
+    # A conflict on every attempt gives up
+    def always_racing(user_cart, inventory_ref):
+        real_validate(user_cart, inventory_ref)
+        inventory_ref[1]["Quantity"] += 0
+    monkeypatch.setattr(project, "validate_cart_arg", always_racing)
+    with pytest.raises(RuntimeError):
+        confirm_purchase_optimistic_arg({1: CartLine(inventory[1], 1)}, inventory, max_retries=3)
+    monkeypatch.undo()
+
+    # Item sold out and re-added under the same code (version back at 0)
+    inventory[5] = Item("Gum", 1.0, 3)
+
+    def readding_validate(user_cart, inventory_ref):
+        real_validate(user_cart, inventory_ref)
+        if inventory_ref[5]["Quantity"] == 3:
+            project.commit_cart_arg({5: CartLine(inventory_ref[5], 3)}, inventory_ref)
+            inventory_ref[5] = Item("Gum", 1.0, 1)
+
+    monkeypatch.setattr(project, "validate_cart_arg", readding_validate)
+    with pytest.raises(ValueError):
+        confirm_purchase_optimistic_arg({5: CartLine(inventory[5], 3)}, inventory)
+    assert inventory[5]["Quantity"] == 1
+    del inventory[5]
+    monkeypatch.undo()
+
+    # Real shortages still raise straight away
+    with pytest.raises(ValueError):
+        confirm_purchase_optimistic_arg({1: CartLine(inventory[1], 6)}, inventory)
+
+    # Many threads never oversell
+    inventory[3] = Item("Chips", 2.0, 500)
+    sold = []
+
+    def customer():
+        for _ in range(200):
+            try:
+                confirm_purchase_optimistic_arg({3: CartLine(inventory[3], 1)}, inventory)
+                sold.append(1)
+            except (KeyError, ValueError):
+                pass
+
+    threads = [threading.Thread(target=customer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sold) == 500
+    assert 3 not in inventory
+
+
+def test_reservations():
+    now = [0.0]
+    book = ReservationBook(ttl=60, clock=lambda: now[0])
+    inventory = {1: Item("Water", 1.0, 3), 2: Item("Soda", 1.5, 5)}
+    alice, bob = {}, {}
+
+    add_to_cart_arg(alice, inventory, 1, 2, book, "alice")
+    assert book.available(inventory, 1) == 1
+    assert book.available(inventory, 1, "alice") == 3
+
+    # Bob cannot take units Alice holds
+    with pytest.raises(ValueError):
+        add_to_cart_arg(bob, inventory, 1, 2, book, "bob")
+    add_to_cart_arg(bob, inventory, 1, 1, book, "bob")
+    with pytest.raises(ValueError):
+        manage_cart_arg(alice, inventory, 1, 'adjust', 3, book, "alice")
+
+    # Alice's hold expires; Bob's was renewed later and survives
+    now[0] = 30
+    add_to_cart_arg(bob, inventory, 2, 1, book, "bob")
+    manage_cart_arg(bob, inventory, 1, 'adjust', 1, book, "bob")
+    now[0] = 61
+    assert book.available(inventory, 1, "bob") == 3
+    manage_cart_arg(bob, inventory, 1, 'adjust', 3, book, "bob")
+    with pytest.raises(ValueError):
+        confirm_purchase_arg(alice, inventory, book, "alice")
+
+    # Buying releases the buyer's holds
+    confirm_purchase_arg(bob, inventory, book, "bob")
+    assert book.reserved == {} and book.holds == {}
+    assert 1 not in inventory
+
+    add_to_cart_arg(alice, inventory, 2, 4, book, "alice")
+    manage_cart_arg(alice, inventory, 2, 'remove', reservations=book, holder="alice")
+    assert book.available(inventory, 2) == 4
+
+
+def test_vending_service(monkeypatch):
+    inventory = Inventory({1: Item("Water", 1.0, 3), 2: Item("Soda", 1.5, 5)})
+    service = VendingService(inventory, "owner", "secret")
+
+    async def request(reader, writer, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) != b"\r\n":
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        return status, json.loads(await reader.readexactly(length))
+
+    async def scenario():
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        alice = await asyncio.open_connection("127.0.0.1", port)
+        bob = await asyncio.open_connection("127.0.0.1", port)
+
+        status, items = await request(*alice, "GET", "/items")
+        assert status == 200 and [item["code"] for item in items] == [1, 2]
+        _, body = await request(*alice, "POST", "/sessions")
+        alice_session = body["session"]
+        _, body = await request(*bob, "POST", "/sessions")
+        bob_session = body["session"]
+
+        status, cart = await request(*alice, "POST", f"/sessions/{alice_session}/cart", {"code": 1, "quantity": 2})
+        assert status == 200 and cart["total"] == 2.0
+        # Alice's units are reserved, so Bob only gets the last one
+        status, body = await request(*bob, "POST", f"/sessions/{bob_session}/cart", {"code": 1, "quantity": 2})
+        assert status == 400
+        status, _ = await request(*bob, "POST", f"/sessions/{bob_session}/cart", {"code": 1, "quantity": 1})
+        assert status == 200
+        status, cart = await request(*alice, "POST", f"/sessions/{alice_session}/cart/1", {"action": "adjust", "quantity": 1})
+        assert cart["items"][0]["quantity"] == 1
+
+        status, body = await request(*alice, "POST", f"/sessions/{alice_session}/checkout")
+        assert status == 200 and len(body["transaction_id"]) == 8 and body["total"] == 1.0
+        assert inventory[1]["Quantity"] == 2
+
+        status, _ = await request(*bob, "POST", "/owner/items/2/price", {"owner_id": "owner", "password": "nope", "price": 2})
+        assert status == 403
+        status, body = await request(*bob, "POST", "/owner/items/2/price", {"owner_id": "owner", "password": "secret", "price": 2})
+        assert status == 200 and body["price"] == 2.0
+        status, _ = await request(*bob, "GET", "/sessions/missing/cart")
+        assert status == 404
+        status, _ = await request(*bob, "DELETE", f"/sessions/{bob_session}")
+        assert status == 200 and service.reservations.reserved == {}
+
+        for _, writer in (alice, bob):
+            writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(scenario())
+
+    # Persistence runs off the event loop, in order, and the reply waits
+    # for it; a backend without a journal still gets its snapshot written
+    written, syncs = [], []
+    release = threading.Event()
+
+    def record_changes(records):
+        assert threading.current_thread() is not threading.main_thread()
+        release.wait(5)
+        written.extend(records)
+        return False
+
+    monkeypatch.setattr(project, "record_changes", record_changes)
+    monkeypatch.setattr(project, "request_sync", lambda: syncs.append(len(written)))
+    service = VendingService(inventory, "owner", "secret", persist=True)
+
+    async def persisted():
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        alice, bob, carol = [await asyncio.open_connection("127.0.0.1", port) for _ in range(3)]
+        _, body = await request(*alice, "POST", "/sessions")
+        session = body["session"]
+        await request(*alice, "POST", f"/sessions/{session}/cart", {"code": 2, "quantity": 1})
+        checkout = asyncio.ensure_future(request(*alice, "POST", f"/sessions/{session}/checkout"))
+        owner = asyncio.ensure_future(request(*bob, "POST", "/owner/items/1/quantity",
+                                              {"owner_id": "owner", "password": "secret", "quantity": 9}))
+        # The loop keeps serving while the first write is held up
+        status, _ = await request(*carol, "GET", "/items")
+        assert status == 200 and not checkout.done() and not owner.done()
+        release.set()
+        assert (await checkout)[0] == 200 and (await owner)[0] == 200
+        for _, writer in (alice, bob, carol):
+            writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(persisted())
+    assert written == [('sell', ((2, 1),)), ('quantity', 1, 9)]
+    assert syncs == [1, 2]
+
+
+def test_vending_service_owner_and_session_limits():
+    inventory = Inventory({1: Item("Water", 1.0, 3), 2: Item("Soda", 1.5, 5)})
+    # Without credentials the owner routes are closed, even to an empty login
+    service = VendingService(inventory)
+    assert service.handle('POST', '/owner/items/1/quantity', {'quantity': 0})[0] == 403
+    assert service.handle('POST', '/owner/items/1/quantity',
+                          {'owner_id': None, 'password': None, 'quantity': 0})[0] == 403
+    assert inventory[1]["Quantity"] == 3
+
+    # Idle sessions expire with their holds; using a session keeps it alive
+    now = [0.0]
+    service.reservations = ReservationBook(ttl=60, clock=lambda: now[0])
+    idle = service.handle('POST', '/sessions', {})[1]["session"]
+    busy = service.handle('POST', '/sessions', {})[1]["session"]
+    assert service.handle('POST', f'/sessions/{idle}/cart', {'code': 1, 'quantity': 3})[0] == 200
+    for _ in range(3):
+        now[0] += 30
+        assert service.handle('GET', f'/sessions/{busy}/cart', {})[0] == 200
+    assert service.handle('GET', f'/sessions/{idle}/cart', {})[0] == 404
+    assert list(service.sessions) == list(service.session_expiry) == [busy]
+    assert service.reservations.reserved == {}
+    assert service.handle('POST', f'/sessions/{busy}/cart', {'code': 1, 'quantity': 3})[0] == 200
+    now[0] += 61
+    assert service.handle('GET', '/items', {})[0] == 200
+    assert not service.sessions and not service.session_expiry and service.reservations.reserved == {}
+
+
+def test_fleet_router():
+    inventory = {code: Item(f"Item {code}", 1.0, 5) for code in range(1, 7)}
+    with FleetRouter(inventory, shards=2) as fleet:
+        assert fleet.items() == inventory
+        assert shard_for(1, 2) != shard_for(2, 2)
+
+        # Cart spanning both shards
+        cart = {}
+        fleet.add_to_cart(cart, 1, 2)
+        fleet.add_to_cart(cart, 2, 5)
+        assert len(fleet.checkout(cart)) == 8
+        assert cart == {}
+        items = fleet.items()
+        assert items[1]["Quantity"] == 3
+        assert 2 not in items
+
+        # One shard refuses: the other shard's part is rolled back
+        fleet.adjust_quantity(4, 1)
+        cart = {3: CartLine(items[3], 2), 4: CartLine(items[4], 2)}
+        with pytest.raises(ValueError):
+            fleet.checkout(cart)
+        assert cart != {}
+        assert fleet.items()[3]["Quantity"] == 5
+        cart[4]["Quantity"] = 1
+        fleet.checkout(cart)
+        assert fleet.items()[3]["Quantity"] == 3
+
+        with pytest.raises(KeyError):
+            fleet.add_to_cart({}, 2, 1)
+        with pytest.raises(KeyError):
+            fleet.checkout({99: CartLine(Item("Ghost", 1.0, 1), 1)})
+        fleet.adjust_price(5, 2.5)
+        assert fleet.items()[5]["Price"] == 2.5
+        final = fleet.items()
+
+    # Closing writes the shards' stock back to the source inventory
+    with pytest.raises(ValueError):
+        fleet.items()
+    assert {code: dict(item) for code, item in inventory.items()} == final
+    assert inventory[3]["Quantity"] == 3 and 2 not in inventory
+
+
+def test_fleet_router_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "INVENTORY_FILE", str(tmp_path / "inventory.pkl"))
+    monkeypatch.setattr(project, "JOURNAL_FILE", str(tmp_path / "inventory.journal"))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", Inventory({code: Item(f"Item {code}", 1.0, 40) for code in range(1, 10)}))
+    project.save_inventory()
+    sold = []
+    monkeypatch.setattr(project, "sale_listeners", [lambda transaction_id, timestamp, lines: sold.append(lines)])
+
+    # One router shared by many threads never oversells
+    with FleetRouter(project.inventory, shards=3, persist=True) as fleet:
+        def shopper(seed):
+            rng = random.Random(seed)
+            for _ in range(60):
+                cart = {}
+                try:
+                    for code in rng.sample(range(1, 9), 2):
+                        fleet.add_to_cart(cart, code, rng.randint(1, 3))
+                    fleet.checkout(cart)
+                except (KeyError, ValueError):
+                    pass
+
+        threads = [threading.Thread(target=shopper, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        fleet.adjust_quantity(9, 7)
+        fleet.adjust_price(9, 2.5)
+        final = fleet.items()
+
+    units = Counter()
+    for lines in sold:
+        for code, quantity, _ in lines:
+            units[code] += quantity
+    assert sold and final[9] == {"Name": "Item 9", "Price": 2.5, "Quantity": 7}
+    for code in range(1, 9):
+        assert units[code] + final.get(code, {"Quantity": 0})["Quantity"] == 40
+    assert {code: dict(item) for code, item in project.inventory.items()} == final
+
+    # Every change was journaled: a restart sees the fleet's stock
+    monkeypatch.setattr(project, "inventory", Inventory())
+    project.load_inventory()
+    assert {code: dict(item) for code, item in project.inventory.items()} == final
+
+
+@pytest.mark.parametrize("backend", ["pickle", "snapshot", "binary", "mmap", "sqlite"])
+def test_fleet_router_persistence(backend, tmp_path, monkeypatch):
+    for name, file_name in [("INVENTORY_FILE", "inventory.pkl"), ("JOURNAL_FILE", "inventory.journal"),
+                            ("BINARY_FILE", "inventory.bin"), ("SQLITE_FILE", "inventory.db")]:
+        monkeypatch.setattr(project, name, str(tmp_path / file_name))
+    monkeypatch.setattr(project, "journal_generation", 0)
+    monkeypatch.setattr(project, "inventory", Inventory({1: Item("Water", 1.0, 10), 2: Item("Soda", 1.5, 3)}))
+    project.save_inventory()
+    monkeypatch.setattr(project, "STORAGE_BACKEND", "pickle" if backend == "snapshot" else backend)
+    monkeypatch.setattr(project, "JOURNAL_MODE", backend != "snapshot")
+    project.load_inventory()
+    store = project.inventory
+    monkeypatch.setattr(project, "stock_listeners", [])
+    monkeypatch.setattr(project, "low_stock", None)
+    monkeypatch.setattr(project, "low_stock_alerts", deque())
+    queue = project.open_low_stock()
+
+    # What a fresh start would load from disk
+    def on_disk():
+        if backend == "sqlite":
+            reopened = SQLiteInventory(project.SQLITE_FILE)
+        elif backend == "mmap":
+            reopened = MappedInventory(project.BINARY_FILE)
+        else:
+            monkeypatch.setattr(project, "inventory", Inventory())
+            project.load_inventory()
+            reopened, project.inventory = project.inventory, store
+        items = {code: dict(item) for code, item in reopened.items()}
+        if backend in ("sqlite", "mmap"):
+            reopened.close()
+        return items
+
+    # SQLite and mmap stores belong to their own thread: no dispatcher writes
+    persist = backend not in ("sqlite", "mmap")
+    if not persist:
+        with pytest.raises(ValueError):
+            FleetRouter(store, shards=2, persist=True)
+    fleet = FleetRouter(store, shards=2, persist=persist)
+    fleet.checkout({1: CartLine(store[1], 4), 2: CartLine(store[2], 3)})
+    fleet.adjust_price(1, 1.25)
+    # The low stock queue follows the shards, sold out items included
+    assert 2 not in queue.position and queue.quantities[1] == 6
+    assert (2, 0) in project.low_stock_alerts
+    expected = {1: {"Name": "Water", "Price": 1.25, "Quantity": 6}}
+    if persist:
+        assert on_disk() == expected
+
+    records = fleet.close()
+    if backend == "sqlite":
+        assert on_disk()[1]["Quantity"] == 10  # not committed yet
+    if not persist:
+        project.record_changes(records)
+    assert {code: dict(item) for code, item in store.items()} == expected
+    assert on_disk() == expected
+    if backend in ("sqlite", "mmap"):
+        store.close()
+
+
+# checkouts per second through one shared router.
+def fleet_throughput(shards, threads, checkouts=400, lines=3):
+    inventory = {code: Item(f"Item {code}", 1.0, 10 ** 6) for code in range(1, 257)}
+    with FleetRouter(inventory, shards=shards) as fleet:
+        def shopper(seed):
+            rng = random.Random(seed)
+            for _ in range(checkouts // threads):
+                codes = rng.sample(range(1, 257), lines)
+                fleet.checkout({code: CartLine(inventory[code], 1) for code in codes})
+
+        workers = [threading.Thread(target=shopper, args=(seed,)) for seed in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return checkouts / (time.perf_counter() - start)
+
+
+def test_fleet_router_batches_concurrent_callers(monkeypatch):
+    # Callers that queue while the dispatcher is busy share one batch, and
+    # so one prepare and one final message per shard
+    inventory = {code: Item(f"Item {code}", 1.0, 100) for code in range(1, 65)}
+    busy = threading.Event()
+    sizes = []
+    exchanges = []
+    run_batch, exchange = FleetRouter.run_batch, FleetRouter.exchange
+
+    def held_batch(self, batch):
+        busy.wait(5)
+        sizes.append(len(batch))
+        return run_batch(self, batch)
+
+    def counted_exchange(self, requests):
+        exchanges.append(sum(1 for shard_requests in requests if shard_requests))
+        return exchange(self, requests)
+
+    monkeypatch.setattr(FleetRouter, "run_batch", held_batch)
+    monkeypatch.setattr(FleetRouter, "exchange", counted_exchange)
+    threads = 32
+    with FleetRouter(inventory, shards=2) as fleet:
+        def shopper(seed):
+            codes = random.Random(seed).sample(range(1, 65), 3)
+            fleet.checkout({code: CartLine(inventory[code], 1) for code in codes})
+
+        workers = [threading.Thread(target=shopper, args=(seed,)) for seed in range(threads)]
+        for worker in workers:
+            worker.start()
+        deadline = time.monotonic() + 5
+        while fleet.requests.qsize() < threads - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        busy.set()
+        for worker in workers:
+            worker.join()
+        assert sizes == [1, threads - 1]
+        assert len(exchanges) == 4 and sum(exchanges) <= 8
+        sold = sum(100 - item["Quantity"] for item in fleet.items().values())
+        assert sold == 3 * threads
+
+
+@benchmark
+def test_fleet_throughput():
+    # Concurrent callers share round trips, so they beat one serial caller
+    serial = fleet_throughput(shards=2, threads=1)
+    shared = fleet_throughput(shards=2, threads=32, checkouts=1000)
+    assert shared > 1.5 * serial
+
+
+@benchmark
+@pytest.mark.skipif((os.cpu_count() or 1) < 4, reason="needs a core per shard")
+def test_fleet_throughput_scales_with_shards():
+    # Large carts keep the shards busy; they validate and commit in parallel
+    one = fleet_throughput(shards=1, threads=32, checkouts=2000, lines=16)
+    four = fleet_throughput(shards=4, threads=32, checkouts=2000, lines=16)
+    assert four > 1.5 * one
+
+
+def test_import_time():
+    # Run a fresh interpreter so modules loaded by other tests don't count
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import project"],
+        capture_output=True, text=True, check=True, cwd=project.os.path.dirname(project.__file__),
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, total, name = line.split("|")
+            if total.strip().isdigit():
+                cumulative[name.strip()] = int(total)
+
+    for heavy in ("pyfiglet", "tabulate", "numpy", "asyncio", "multiprocessing"):
+        assert heavy not in cumulative
+    if BENCHMARKS:
+        # Microseconds; generous so a cold bytecode compile still passes
+        assert cumulative["project"] < 500_000
+
+
+
+def test_banner_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(project, "BANNER_CACHE_FILE", str(tmp_path / "banners.pkl"))
+    monkeypatch.setattr(project, "banner_cache", None)
+    banner = project.render_banner("Thank You")
+    assert banner.strip()
+    assert project.render_banner("Thank You", "smslant") != banner
+    assert project.banner_cache[("standard", "Thank You")] == banner
+
+    # A fresh process reuses the saved art without rendering again
+    monkeypatch.setattr(project, "banner_cache", None)
+    monkeypatch.setitem(sys.modules, "pyfiglet", None)
+    assert project.render_banner("Thank You") == banner
+
+    # Caching is kept in memory only unless a file is asked for
+    env = {key: value for key, value in os.environ.items() if key != "VENDING_BANNER_CACHE"}
+    default = subprocess.run([sys.executable, "-c", "import project; print(project.BANNER_CACHE_FILE)"],
+                             cwd=os.path.dirname(project.__file__), env=env,
+                             capture_output=True, text=True, check=True)
+    assert default.stdout.strip() == "None"
+    monkeypatch.setattr(project, "BANNER_CACHE_FILE", None)
+    monkeypatch.setattr(project, "banner_cache", None)
+    with pytest.raises(ImportError):
+        project.render_banner("Thank You")
+
+
+def test_table_renderer():
+    headers = ['Item Code', 'Item Name', 'Price(in $)', 'Quantity(units)']
+    rows = [[1, "Cola", 1.5, 10], [22, "Chips long", 12.25, 3], [3, "X", 2.0, 100]]
+    expected = (
+        "╒═════════════╤═════════════╤═══════════════╤═══════════════════╕\n"
+        "│   Item Code │ Item Name   │   Price(in $) │   Quantity(units) │\n"
+        "╞═════════════╪═════════════╪═══════════════╪═══════════════════╡\n"
+        "│           1 │ Cola        │          1.5  │                10 │\n"
+        "├─────────────┼─────────────┼───────────────┼───────────────────┤\n"
+        "│          22 │ Chips long  │         12.25 │                 3 │\n"
+        "├─────────────┼─────────────┼───────────────┼───────────────────┤\n"
+        "│           3 │ X           │          2    │               100 │\n"
+        "╘═════════════╧═════════════╧═══════════════╧═══════════════════╛"
+    )
+    assert project.render_table(rows, headers) == expected
+
+    table = project.TableRenderer(headers)
+    table.sync((row[0], row) for row in rows)
+    assert table.render() == expected
+    lines = dict(table.lines)
+
+    # One changed row is re-formatted; the others are reused as-is
+    table.update(3, [3, "X", 2.0, 99])
+    table.update(1, [1, "Cola", 1.5, 10])
+    table.render()
+    assert table.lines[1] is lines[1] and table.lines[22] is lines[22]
+    assert table.lines[3] != lines[3]
+
+    # Dropping the widest row shrinks its column
+    table.sync((row[0], row) for row in rows if row[0] != 22)
+    assert len(table) == 2
+    assert "Chips" not in table.render()
+    assert table.render().splitlines()[0] == "╒═════════════╤═════════════╤═══════════════╤═══════════════════╕"
+    table.update(4, [4, "A much longer name", 0.25, 1])
+    assert "│ A much longer name │" in table.render([4, 1])
+    assert table.render([4, 1]).index("A much") < table.render([4, 1]).index("Cola")
+
+
+def test_query_items_arg(tmp_path):
+    random.seed(7)
+    names = ["Cola", "Coffee", "Chips", "Candy", "Water", "Wafer", "Gum", "cocoa"]
+    items = {}
+    for code in random.sample(range(1, 500), 120):
+        name = f"{random.choice(names)} {code}"
+        items[code] = Item(name, round(random.uniform(0.5, 5), 2), random.randint(0, 30))
+
+    def expected(low=None, high=None, prefix=None, sort_by='code', descending=False):
+        field = {'name': 'Name', 'price': 'Price', 'quantity': 'Quantity'}.get(sort_by)
+        rows = [[code, item['Name'], item['Price'], item['Quantity']] for code, item in items.items()
+                if (low is None or code >= low) and (high is None or code <= high)
+                and (prefix is None or item['Name'].casefold().startswith(prefix.casefold()))]
+        if field == 'Name':
+            rows.sort(key=lambda row: (row[1].casefold(), row[0]), reverse=descending)
+        elif field:
+            rows.sort(key=lambda row: (items[row[0]][field], row[0]), reverse=descending)
+        else:
+            rows.sort(reverse=descending)
+        return rows
+
+    db = SQLiteInventory(str(tmp_path / "inventory.db"))
+    db.update(items)
+    stores = [Inventory(items), dict(items), db]
+    queries = [{}, {"low": 100, "high": 300}, {"prefix": "co"}, {"prefix": "CO", "low": 250},
+               {"sort_by": "name"}, {"sort_by": "price", "descending": True},
+               {"sort_by": "quantity", "prefix": "w"}, {"sort_by": "name", "descending": True, "high": 200},
+               {"prefix": "zzz"}]
+    for store in stores:
+        for query in queries:
+            rows = expected(**query)
+            for page in (1, 2, 5):
+                assert query_items_arg(store, page, 10, **query) == (rows[(page - 1) * 10:page * 10], len(rows))
+
+    # Sorted indexes follow later changes
+    inventory = stores[0]
+    del inventory[min(items)]
+    inventory[1000] = Item("Coconut", 1.0, 1)
+    inventory[1000] = Item("Apple", 1.0, 1)
+    inventory.pop(max(items))
+    assert query_items_arg(inventory, 1, 1, sort_by="name")[0][0][1] == "Apple"
+    assert query_items_arg(inventory, 1, 200, low=990)[0] == [[1000, "Apple", 1.0, 1]]
+    assert query_items_arg(inventory, prefix="coconut") == ([], 0)
+    assert query_items_arg(inventory, 1, 500)[1] == 119
+
+    with pytest.raises(ValueError):
+        query_items_arg(inventory, 0)
+    with pytest.raises(ValueError):
+        query_items_arg(inventory, sort_by="colour")
+    with pytest.raises(ValueError):
+        query_items_arg(inventory, low=10, high=5)
+    db.close()
+
+
+def test_sales_ledger(tmp_path, monkeypatch):
+    directory = str(tmp_path / "sales")
+    ledger = SalesLedger(directory, segment_bytes=200, buffer_bytes=100)
+    monkeypatch.setattr(project, "sale_listeners", [ledger.append])
+
+    inventory = Inventory({1: Item("Cola", 1.5, 50), 2: Item("Chips", 2.25, 50)})
+    transaction_ids = []
+    for _ in range(10):
+        cart = {}
+        add_to_cart_arg(cart, inventory, 1, 2)
+        add_to_cart_arg(cart, inventory, 2, 1)
+        transaction_ids.append(confirm_purchase_arg(cart, inventory))
+    carts = [{1: CartLine(inventory[1], 3)}, {2: CartLine(inventory[2], 99)}]
+    results = confirm_purchases_batch_arg(carts, inventory)
+    transaction_ids.append(results[0][1])
+
+    # Small buffer and segments: several segments, last sales still buffered
+    assert len(ledger.segment_numbers()) > 1
+    assert ledger.buffer
+    sales = ledger.read()
+    assert not isinstance(sales, list)
+    sales = list(sales)
+    assert [sale[0] for sale in sales] == transaction_ids
+    assert sales[0][2] == ((1, 2, 1.5), (2, 1, 2.25))
+    assert sales[-1][2] == ((1, 3, 1.5),)
+    assert all(sale[1] <= time.time() for sale in sales)
+
+    # A torn record left by a crash is cut off when the ledger is reopened
+    last = ledger.segment_path(ledger.segment_numbers()[-1])
+    with open(last, "ab") as f:
+        f.write(b"torn")
+    reopened = SalesLedger(directory, segment_bytes=200, buffer_bytes=100)
+    assert [sale[0] for sale in reopened.read()] == transaction_ids
+    reopened.append("abcd1234", time.time(), ((2, 1, 2.25),))
+    assert list(reopened.read())[-1][0] == "abcd1234"
+
+    # A quiet ledger writes its buffer once flush_seconds have passed
+    quiet = SalesLedger(directory, flush_seconds=0.05)
+    quiet.append("quiet123", time.time(), ((1, 1, 1.5),))
+    assert quiet.buffer
+    quiet.flush_timer.join(5)
+    assert not quiet.buffer and quiet.flush_timer is None
+    assert list(SalesLedger(directory).read())[-1][0] == "quiet123"
+
+    # main() writes buffered sales even when the menu is interrupted
+    def interrupted(owner_id, owner_password):
+        quiet.append("ctrlc123", time.time(), ((2, 1, 2.25),))
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(project, "setup_or_load_credentials", lambda: ("owner", "secret"))
+    monkeypatch.setattr(project, "load_inventory", lambda: None)
+    monkeypatch.setattr(project, "open_low_stock", lambda: None)
+    monkeypatch.setattr(project, "open_sales_ledger", lambda: quiet)
+    monkeypatch.setattr(project, "open_sales_rollups", lambda ledger: None)
+    monkeypatch.setattr(project, "open_best_sellers", lambda ledger: None)
+    monkeypatch.setattr(project, "run_menu", interrupted)
+    monkeypatch.setattr(project, "sales_ledger", quiet)
+    monkeypatch.setattr(project, "sales_rollups", None)
+    quiet.flush_seconds = 60
+    with pytest.raises(KeyboardInterrupt):
+        project.main()
+    assert not quiet.buffer
+    assert list(SalesLedger(directory).read())[-1][0] == "ctrlc123"
+
+
+def test_sales_rollups(tmp_path, monkeypatch):
+    rollups = SalesRollups()
+    noon = datetime(2026, 3, 14, 12, 30).timestamp()
+    rollups.add("t1", noon, ((1, 2, 1.5), (2, 1, 2.25)))
+    rollups.add("t2", noon + 60, ((1, 1, 1.5),))
+    rollups.add("t3", noon + 3600, ((2, 4, 2.25),))
+    hour = int(noon // 3600)
+    assert rollups.hourly[hour] == {1: [3, 450], 2: [1, 225]}
+    assert rollups.hourly[hour + 1] == {2: [4, 900]}
+    assert list(zip(rollups.sale_codes, rollups.sale_hours, rollups.sale_units)) == [
+        (1, hour, 3), (2, hour, 1), (2, hour + 1, 4)]
+    assert rollups.daily[datetime(2026, 3, 14).toordinal()] == {1: [3, 450], 2: [5, 1125]}
+    assert rollups.top_sellers(1) == [(2, 5, 11.25)]
+    assert rollups.top_sellers(2, by='revenue') == [(2, 5, 11.25), (1, 3, 4.5)]
+    assert rollups.revenue_on(datetime(2026, 3, 14)) == 15.75
+    assert rollups.revenue_on(datetime(2026, 3, 15)) == 0
+    assert rollups.revenue_last_hours(1, now=noon + 3600) == 9.0
+    assert rollups.revenue_last_hours(2, now=noon + 3600) == 15.75
+
+    # Pruning drops buckets past retention; totals are kept
+    monkeypatch.setattr(project, "FORECAST_HISTORY_HOURS", 24)
+    monkeypatch.setattr(project, "ROLLUP_RETENTION_DAYS", 7)
+    rollups.prune(now=noon + 3600 + 23 * 3600)
+    assert list(rollups.hourly) == list(rollups.hourly_cents) == [hour + 1]
+    assert list(rollups.sale_codes) == [2] and list(rollups.sale_units) == [4]
+    rollups.add("t4", noon + 3660, ((2, 1, 2.25),))
+    assert list(rollups.sale_codes) == [2] and list(rollups.sale_units) == [5]
+    assert len(rollups.daily) == len(rollups.daily_cents) == 1
+    rollups.prune(now=noon + 7 * 86400)
+    assert not rollups.hourly and not rollups.hourly_cents
+    assert not rollups.daily and not rollups.daily_cents
+    assert not rollups.sale_codes and not rollups.sale_hours and not rollups.sale_units
+    assert rollups.totals == {1: [3, 450], 2: [6, 1350]} and rollups.cents == 1800
+    monkeypatch.undo()
+
+    # Rollups follow checkouts and are rebuilt from the ledger tail
+    monkeypatch.setattr(project, "LEDGER_DIR", str(tmp_path / "sales"))
+    monkeypatch.setattr(project, "ROLLUP_FILE", str(tmp_path / "rollups.pkl"))
+    monkeypatch.setattr(project, "sale_listeners", [])
+    monkeypatch.setattr(project, "sales_ledger", None)
+    monkeypatch.setattr(project, "sales_rollups", None)
+    ledger = project.open_sales_ledger()
+    live = project.open_sales_rollups(ledger)
+    inventory = Inventory({1: Item("Cola", 1.5, 50), 2: Item("Chips", 2.25, 50)})
+
+    def buy(code, quantity):
+        cart = {}
+        add_to_cart_arg(cart, inventory, code, quantity)
+        confirm_purchase_arg(cart, inventory)
+
+    buy(1, 2)
+    buy(2, 3)
+    project.flush_sales()
+    buy(1, 4)
+    ledger.flush()  # sale on disk, rollups not saved: as after a crash
+    assert live.totals == {1: [6, 900], 2: [3, 675]}
+
+    monkeypatch.setattr(project, "sale_listeners", [ledger.append])
+    monkeypatch.setattr(project, "sales_rollups", None)
+    reopened = project.open_sales_rollups(ledger)
+    assert reopened is not live
+    assert reopened.totals == live.totals and reopened.sales == 3
+    assert reopened.daily_cents == live.daily_cents
+
+
+def test_heavy_hitters(tmp_path, monkeypatch, capsys):
+    random.seed(3)
+    tracker = HeavyHitters(capacity=20)
+    true_counts = {}
+    for _ in range(20000):
+        code = int(random.paretovariate(1.2))  # a few codes sell far more
+        weight = random.randint(1, 3)
+        tracker.add(code, weight)
+        true_counts[code] = true_counts.get(code, 0) + weight
+        assert len(tracker.counts) <= 20 and len(tracker.heap) <= 81
+
+    assert len(true_counts) > 100
+    assert tracker.total == sum(true_counts.values())
+    exact = sorted(true_counts, key=true_counts.get, reverse=True)[:3]
+    assert [code for code, _, _ in tracker.top(3)] == exact
+    for code, count, error in tracker.top(20):
+        assert count - error <= true_counts[code] <= count
+    for code, count in true_counts.items():
+        if count > tracker.total / 20:
+            assert code in tracker.counts
+
+    # Fed by checkouts through the sale listeners
+    sellers = BestSellers(capacity=2)
+    rollups = SalesRollups()
+    project.sale_listeners.extend([sellers.add, rollups.add])
+    try:
+        inventory = Inventory({1: Item("Cola", 1.5, 50), 2: Item("Chips", 4.0, 50), 3: Item("Gum", 0.5, 50)})
+        for code, quantity in [(1, 5), (2, 2), (1, 3), (3, 1)]:
+            cart = {}
+            add_to_cart_arg(cart, inventory, code, quantity)
+            confirm_purchase_arg(cart, inventory)
+    finally:
+        project.sale_listeners.remove(sellers.add)
+        project.sale_listeners.remove(rollups.add)
+    assert sellers.top(1) == [(1, 8, 0)]
+    assert sellers.top(1, by='revenue') == [(1, 12.0, 0.0)]
+    assert len(sellers.units.counts) == 2
+
+    # Gum took over the Chips counter, so the tracker says 3 units, at most
+    # 2 too many; the report shows the range
+    assert sellers.top(2)[1] == (3, 3, 2)
+    monkeypatch.setattr(project, "inventory", inventory)
+    monkeypatch.setattr(project, "sales_rollups", rollups)
+    monkeypatch.setattr(project, "best_sellers", sellers)
+    project.sales_report()
+    cells = [[cell.strip() for cell in line.split('│')[1:-1]] for line in capsys.readouterr().out.splitlines()]
+    rows = {row[1]: row[2:] for row in cells if row[1:2] in (['Cola'], ['Gum'])}
+    assert rows == {'Cola': ['8', '12'], 'Gum': ['1-3', '0.50-8.50']}
+
+    # Saved with the ledger position and caught up from the ledger alone,
+    # without the rollups
+    monkeypatch.setattr(project, "LEDGER_DIR", str(tmp_path / "sales"))
+    monkeypatch.setattr(project, "BEST_SELLERS_FILE", str(tmp_path / "best_sellers.pkl"))
+    monkeypatch.setattr(project, "HEAVY_HITTER_CAPACITY", 2)
+    monkeypatch.setattr(project, "sale_listeners", [])
+    monkeypatch.setattr(project, "sales_ledger", None)
+    monkeypatch.setattr(project, "sales_rollups", None)
+    monkeypatch.setattr(project, "best_sellers", None)
+    ledger = project.open_sales_ledger()
+    live = project.open_best_sellers(ledger)
+    assert live.units.capacity == 2 and live.units.total == 0
+
+    def buy(code, quantity):
+        cart = {}
+        add_to_cart_arg(cart, inventory, code, quantity)
+        confirm_purchase_arg(cart, inventory)
+
+    buy(1, 2)
+    buy(2, 3)
+    project.flush_sales()
+    buy(3, 4)
+    ledger.flush()  # sale on disk, tracker not saved: as after a crash
+    monkeypatch.setattr(project, "sale_listeners", [ledger.append])
+    monkeypatch.setattr(project, "best_sellers", None)
+    reopened = project.open_best_sellers(ledger)
+    assert reopened is not live
+    assert reopened.units.counts == live.units.counts and reopened.units.total == 9
+    assert reopened.top(2, by='revenue') == live.top(2, by='revenue')
+    # From scratch the whole ledger is replayed
+    os.remove(project.BEST_SELLERS_FILE)
+    monkeypatch.setattr(project, "best_sellers", None)
+    assert project.open_best_sellers(ledger).units.counts == live.units.counts
+
+
+def test_low_stock_queue(monkeypatch, capsys):
+    random.seed(5)
+    inventory = Inventory({code: Item(f"Item {code}", 1.0, random.randint(1, 40)) for code in range(1, 201)})
+    queue = LowStockQueue(threshold=5)
+    alerts = []
+    queue.alert_listeners.append(lambda code, quantity: alerts.append((code, quantity)))
+    queue.load(inventory)
+    monkeypatch.setattr(project, "stock_listeners", [queue.update])
+
+    def expected(k):
+        return sorted((item['Quantity'], code) for code, item in inventory.items())[:k]
+
+    for _ in range(500):
+        code = random.choice(list(inventory))
+        before = inventory[code]['Quantity']
+        if before and random.random() < 0.7:
+            cart = {}
+            add_to_cart_arg(cart, inventory, code, random.randint(1, before))
+            confirm_purchase_arg(cart, inventory)
+        else:
+            adjust_quantity_arg(inventory, code, random.randint(0, 40))
+        after = inventory[code]['Quantity'] if code in inventory else 0
+        if after <= 5 < before or after == 0 < before:
+            assert alerts.pop() == (code, after)
+        assert not alerts
+        assert [(quantity, code) for code, quantity, _ in queue.lowest(10)] == expected(10)
+        assert len(queue) == len(inventory)
+
+    low = queue.lowest(1000, only_low=True)
+    assert [code for code, _, _ in low] == [code for quantity, code in expected(1000) if quantity <= 5]
+
+    # Stock set to 0 stays in the inventory and in the queue; only removal
+    # drops it, and the owner is told which happened
+    code = max(inventory, key=lambda code: inventory[code]['Quantity'])
+    adjust_quantity_arg(inventory, code, 0)
+    assert alerts.pop() == (code, 0) and queue.lowest(1)[0][:2] == (code, 0)
+    other = next(other for other in inventory if inventory[other]['Quantity'] > 0)
+    cart = {}
+    add_to_cart_arg(cart, inventory, other, inventory[other]['Quantity'])
+    confirm_purchase_arg(cart, inventory)
+    assert alerts.pop() == (other, 0) and other not in queue.position
+    assert len(queue) == len(inventory)
+    assert project.low_stock_alerts.maxlen == project.LOW_STOCK_ALERT_LIMIT
+    monkeypatch.setattr(project, "inventory", inventory)
+    monkeypatch.setattr(project, "low_stock_alerts", deque([(code, 0), (other, 0)]))
+    project.show_low_stock_alerts()
+    assert capsys.readouterr().out.splitlines()[-2:] == [
+        f"Item code {code} is out of stock.", f"Item code {other} sold out and was removed from inventory."]
+    assert not project.low_stock_alerts
+
+    # Keyed by days of cover: fast sellers come first
+    rollups = SalesRollups()
+    rollups.add("t1", time.time(), ((1, 70, 1.0),))
+    cover = LowStockQueue(threshold=2, daily_rate=rollups.units_per_day)
+    cover.load(Inventory({1: Item("Cola", 1.0, 30), 2: Item("Gum", 1.0, 3)}))
+    assert cover.lowest(2) == [(1, 30, 3.0), (2, 3, float('inf'))]
+    cover.alert_listeners.append(lambda code, quantity: alerts.append((code, quantity)))
+    cover.update(1, 12)
+    assert alerts == [(1, 12)]
+
+
+def test_restock_forecast():
+    np = pytest.importorskip("numpy")
+    now = datetime(2026, 3, 14, 12).timestamp()
+    now_hour = int(now // 3600)
+    rollups = SalesRollups()
+    for hour in range(60 * 24):  # 60 days of history
+        timestamp = now - hour * 3600
+        rollups.add("t", timestamp, ((1, 1, 1.0),))  # 24 a day
+        if hour % 24 == 0:
+            rollups.add("t", timestamp, ((2, 2, 1.0),))  # 2 a day
+    inventory = Inventory({1: Item("Cola", 1.0, 30), 2: Item("Gum", 1.0, 3), 3: Item("Tea", 1.0, 1)})
+
+    plan = restock_plan_arg(inventory, rollups, now=now)
+    assert [row[0] for row in plan] == [1, 2]  # Tea never sells
+    code, quantity, new_quantity, hours_left = plan[0]
+    assert quantity == 30 and abs(hours_left - 30) < 0.5
+    assert new_quantity == 24 * 14
+
+    # Matches a plain hour-by-hour EWMA
+    alpha = 1 - 0.5 ** (1 / project.FORECAST_HALF_LIFE_HOURS)
+    rate = 0.0
+    for hour in range(now_hour - 60 * 24, now_hour + 1):
+        units = rollups.hourly.get(hour, {}).get(2, (0, 0))[0]
+        rate = alpha * units + (1 - alpha) * rate
+    assert plan[1] == (2, 3, int(np.ceil(rate * 24 * 14)), pytest.approx(3 / rate))
+
+    # Applied in one step through adjust_quantity_arg
+    records = apply_restock_plan_arg(inventory, plan)
+    assert records == [('quantity', 1, new_quantity), ('quantity', 2, plan[1][2])]
+    assert inventory[1]["Quantity"] == new_quantity
+    assert restock_plan_arg(inventory, rollups, now=now) == []
+    with pytest.raises(KeyError):
+        apply_restock_plan_arg(inventory, [(9, 0, 5, 1.0)] + plan)
+
+    # 100k items with a year of sparse hourly sales
+    rng = np.random.default_rng(0)
+    items = 100_000
+    codes = rng.permutation(np.arange(1, items + 1))
+    quantities = rng.integers(0, 50, items)
+    sales = 2_000_000
+    sale_codes = rng.integers(1, items + 1, sales)
+    sale_hours = now_hour - rng.integers(0, 365 * 24, sales)
+    sale_units = rng.integers(1, 5, sales)
+    big_plan = forecast_restock(codes, quantities, sale_codes, sale_hours, sale_units, now_hour)
+    assert big_plan and all(row[2] > row[1] for row in big_plan)
+    assert [row[3] for row in big_plan] == sorted(row[3] for row in big_plan)
+    # Codes too sparse for a lookup table give the same plan
+    sparse_plan = forecast_restock(codes * 1000, quantities, sale_codes * 1000, sale_hours, sale_units, now_hour)
+    assert [row[1:] for row in sparse_plan] == [row[1:] for row in big_plan]
+
+    # End to end from the inventory and rollups, with 3M sale entries in time order
+    big_inventory = Inventory({code: Item(f"Item {code}", 1.0, quantity)
+                               for code, quantity in zip(codes.tolist(), quantities.tolist())})
+    big_rollups = SalesRollups()
+    order = np.argsort(sale_hours, kind='stable')
+    extra = 1_000_000
+    for column, values in ((big_rollups.sale_codes, np.concatenate([sale_codes[order], sale_codes[:extra]])),
+                           (big_rollups.sale_hours, np.concatenate([sale_hours[order], np.full(extra, now_hour)])),
+                           (big_rollups.sale_units, np.concatenate([sale_units[order], sale_units[:extra]]))):
+        column.frombytes(values.astype(np.int64).tobytes())
+    plan = restock_plan_arg(big_inventory, big_rollups, now=now)
+    assert plan and all(row[2] > row[1] for row in plan)